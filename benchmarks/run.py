@@ -0,0 +1,190 @@
+'''
+Times and measures the peak memory of the hot paths on synthetic LoanStats data.
+
+    python benchmarks/run.py --sizes 10000,100000,1000000 --output results.json
+    python benchmarks/run.py --sizes 10000 --compare results.json
+
+Every stage runs in a fresh interpreter, so its peak memory is its own. Peak is the
+process high-water mark after the stage, setup the mark before the timed part started
+(imports plus loading the stage's inputs). Data and caches live in --workdir, one
+folder per size, and are reused across runs with the same seed.
+'''
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+solvers = ['simple_filter_buy_solver', 'generic_buy_solver', 'single_buy_solver', 'zero_buy_solver',
+           'simple_filter_solver']
+investors = ['Investor', 'PortfolioInvestor', 'ScheduledInvestor']
+
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def load_db():
+    from com.lc_helpers import get_cache_historic
+    return get_cache_historic()
+
+
+def make_backtest(size, solver, investor, db=None):
+    from com import backtest, investor as investor_module, solvers as solver_module
+    buy_solver = getattr(backtest, solver, None) or getattr(solver_module, solver)
+    # cash for about a percent of the market in $25 notes, so purchases scale with size
+    return backtest.Backtest('2008-01', '2015-12', buy_solver, load_db() if db is None else db,
+                             cash=max(1000, size / 4), investor_class=getattr(investor_module, investor))
+
+
+def run_stage(stage, size, seed, solver, investor):
+    '''
+    Runs one stage in this process.
+
+    returns: dict, seconds and memory of the timed part
+    '''
+    sys.path.insert(0, repo)
+    if stage == 'generate':
+        from com.synthetic import write_loan_stats
+        run = lambda: write_loan_stats(size, seed=seed)
+    elif stage == 'ingest':
+        from com.lc_helpers import get_cache_historic
+        run = lambda: get_cache_historic(rewrite=True)
+    elif stage == 'load':
+        import com.lc_helpers
+        run = load_db
+    elif stage == 'make_df_numeric':
+        import pandas as pd
+        from com.lc_helpers import get_db_folder, historic_sources, read_loan_csv, make_df_numeric
+        raw = pd.concat([read_loan_csv(get_db_folder()[source]) for source in historic_sources])
+        run = lambda: make_df_numeric(raw.copy(), fix_nans=True)
+    elif stage == 'backtest':
+        bt = make_backtest(size, solver, investor)
+        run = bt.run
+    elif stage == 'partitioned':
+        # the out-of-core backtest, the store is built (if stale) before timing
+        from com import solvers as solver_module
+        from com.lc_helpers import get_partitioned_historic
+        from com.loan import loan_columns
+        source = get_partitioned_historic()
+        buy_solver = getattr(solver_module, solver, None)
+        if hasattr(buy_solver, 'columns'):
+            source = get_partitioned_historic(columns=loan_columns + buy_solver.columns())
+        bt = make_backtest(size, solver, investor, source)
+        run = bt.run
+    elif stage == 'report':
+        from com.report import Report
+        bt = make_backtest(size, solver, investor)
+        bt.run()
+        report = Report(bt, os.path.join('report', 'report.html'))
+        if not os.path.exists('report'):
+            os.makedirs('report')
+        run = lambda: report.save()
+    else:
+        raise ValueError('unknown stage {}'.format(stage))
+
+    setup = peak_mb()
+    start = time.time()
+    run()
+    seconds = time.time() - start
+    return {'seconds': seconds, 'setup_mb': setup, 'peak_mb': peak_mb()}
+
+
+def stage_plan(solver_names, investor_names, report_solver):
+    plan = [('generate', None, None), ('ingest', None, None), ('load', None, None), ('make_df_numeric', None, None)]
+    plan += [('backtest', solver, investor) for investor in investor_names for solver in solver_names]
+    plan.append(('partitioned', report_solver, investor_names[0]))
+    plan.append(('report', report_solver, investor_names[0]))
+    return plan
+
+
+def stage_label(stage, solver, investor):
+    return ' '.join(part for part in [stage, solver, investor] if part)
+
+
+def run_suite(sizes, workdir, seed=0, solver_names=solvers, investor_names=investors[:1], regenerate=False):
+    results = []
+    for size in sizes:
+        folder = os.path.join(workdir, str(size))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        marker = os.path.join(folder, 'generated.json')
+        generated = os.path.exists(marker) and json.load(open(marker)) == {'size': size, 'seed': seed}
+        for stage, solver, investor in stage_plan(solver_names, investor_names, solver_names[0]):
+            if stage == 'generate' and generated and not regenerate:
+                continue
+            command = [sys.executable, os.path.abspath(__file__), '--stage', stage, '--sizes', str(size),
+                       '--seed', str(seed)]
+            if solver:
+                command += ['--solver', solver, '--investor', investor]
+            output = subprocess.check_output(command, cwd=folder)
+            result = json.loads(output.strip().splitlines()[-1])
+            result.update(size=size, stage=stage_label(stage, solver, investor))
+            results.append(result)
+            print('{size:>9} {stage:<50} {seconds:>9.2f}s {peak_mb:>9.0f}MB peak {setup_mb:>9.0f}MB setup'.format(**result))
+            sys.stdout.flush()
+            if stage == 'generate':
+                json.dump({'size': size, 'seed': seed}, open(marker, 'w'))
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    '''
+    Prints each stage's time and peak memory relative to a previous run, flagging
+    those that grew by more than threshold.
+    '''
+    previous = {(result['size'], result['stage']): result for result in baseline}
+    for result in results:
+        old = previous.get((result['size'], result['stage']))
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / max(old['seconds'], 1e-9)
+        memory_ratio = result['peak_mb'] / max(old['peak_mb'], 1e-9)
+        flag = 'REGRESSION' if max(time_ratio, memory_ratio) > threshold else ''
+        print('{:>9} {:<50} {:>6.2f}x time {:>6.2f}x memory {}'.format(
+            result['size'], result['stage'], time_ratio, memory_ratio, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma separated numbers of loans')
+    parser.add_argument('--workdir', default=os.path.join(repo, 'benchmarks', 'work'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--solvers', default=','.join(solvers))
+    parser.add_argument('--investors', default=investors[0], help='comma separated, from {}'.format(', '.join(investors)))
+    parser.add_argument('--regenerate', action='store_true', help='write the synthetic CSVs even if present')
+    parser.add_argument('--output', help='save the results as json')
+    parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    # internal, runs a single stage in the current directory
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    parser.add_argument('--solver', help=argparse.SUPPRESS)
+    parser.add_argument('--investor', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    if args.stage:
+        warnings.simplefilter('ignore')
+        stdout = sys.stdout
+        # backtests print every month
+        sys.stdout = open(os.devnull, 'w')
+        result = run_stage(args.stage, sizes[0], args.seed, args.solver, args.investor)
+        sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    results = run_suite(sizes, os.path.abspath(args.workdir), args.seed, args.solvers.split(','),
+                        args.investors.split(','), args.regenerate)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.compare:
+        compare(results, json.load(open(args.compare)))
+
+
+if __name__ == '__main__':
+    main()
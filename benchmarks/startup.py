@@ -0,0 +1,107 @@
+'''
+Measures what importing each entry module costs a fresh worker process.
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --compare startup.json
+
+Every import runs in a new interpreter, --repeat times. The table shows the median import
+time, the peak memory after the import, what that adds to an empty interpreter, and which
+heavy dependencies (plotting, templating) the import pulled in.
+'''
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+modules = ['com.compute', 'com.backtest', 'com.lc_helpers', 'com.report']
+# old pandas imports matplotlib itself, pyplot is what plotting code adds
+heavy = ['matplotlib.pyplot', 'seaborn', 'jinja2', 'scipy']
+
+
+def measure(module):
+    '''
+    Imports module in this process.
+
+    returns: dict, seconds, peak memory and the heavy modules loaded
+    '''
+    sys.path.insert(0, repo)
+    start = time.time()
+    if module:
+        __import__(module)
+    seconds = time.time() - start
+    return {'seconds': seconds, 'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'heavy': [name for name in heavy if name in sys.modules]}
+
+
+def run_module(module, repeat):
+    runs = []
+    for _ in range(repeat):
+        command = [sys.executable, os.path.abspath(__file__), '--measure', module]
+        output = subprocess.check_output(command, cwd=repo)
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    seconds = sorted(run['seconds'] for run in runs)
+    return {'module': module or '(interpreter)', 'seconds': seconds[len(seconds) // 2],
+            'peak_mb': max(run['peak_mb'] for run in runs), 'heavy': runs[-1]['heavy']}
+
+
+def run_suite(module_names, repeat):
+    results = []
+    print('{:<20} {:>9} {:>10} {:>10}  {}'.format('module', 'import', 'peak', 'added', 'heavy imports'))
+    for module in [''] + module_names:
+        result = run_module(module, repeat)
+        # over the empty interpreter measured first
+        result['added_mb'] = result['peak_mb'] - (results[0]['peak_mb'] if results else result['peak_mb'])
+        results.append(result)
+        print('{module:<20} {seconds:>8.3f}s {peak_mb:>8.0f}MB {added_mb:>8.0f}MB  '.format(**result) +
+              ', '.join(result['heavy']))
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, threshold=1.2):
+    '''
+    Prints each module's import time and added memory relative to a previous run, flagging
+    those that grew by more than threshold or pulled in new heavy imports.
+    '''
+    previous = {result['module']: result for result in baseline}
+    for result in results:
+        old = previous.get(result['module'])
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / max(old['seconds'], 1e-9)
+        memory_ratio = result['peak_mb'] / max(old['peak_mb'], 1e-9)
+        new_heavy = sorted(set(result['heavy']) - set(old['heavy']))
+        flag = 'REGRESSION' if max(time_ratio, memory_ratio) > threshold or new_heavy else ''
+        print('{:<20} {:>6.2f}x time {:>6.2f}x memory {} {}'.format(
+            result['module'], time_ratio, memory_ratio, ', '.join(new_heavy), flag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', default=','.join(modules), help='comma separated modules to import')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per module')
+    parser.add_argument('--output', help='save the results as json')
+    parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    # internal, imports a single module in the current process
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        print(json.dumps(measure(args.measure)))
+        return
+
+    results = run_suite(args.modules.split(','), args.repeat)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.compare:
+        compare(results, json.load(open(args.compare)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,75 +1,181 @@
+import copy
+import os
+import pickle
 import warnings
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from exceptions import ZeroDivisionError
 
 import pandas as pd
 import numpy as np
 
-from loan import Loan
+from loan import Loan, loan_batch
 from investor import Investor
+from month_index import get_month_index
+from compact import with_dummies
+from ledger import HoldingsLog
+from instrument import null_instrument
+from streaming import OnlineStats
 
 class Backtest():
-    def __init__(self, sdate, edate, buy_solver, db, cash=1000, buy_size=25.0, liquidity_limit=1.0):
-        self.investor = Investor(cash)
+    # shared with the caller rather than saved in checkpoints or copied into forks
+    shared_state = ['db', 'month_index', 'instrument']
+
+    def __init__(self, sdate, edate, buy_solver, db, cash=1000, buy_size=25.0, liquidity_limit=1.0, investor_class=Investor,
+                 month_index=None, dummies=None, instrument=None):
+        '''
+        :param db: pandas.DataFrame, the historic loans, or a source serving them a month at a time
+            such as a PartitionedSource (see get_partitioned_historic) to keep them out of memory
+        :param investor_class: Investor keeps a list of Loan objects, PortfolioInvestor keeps the
+            book in NumPy arrays and is much faster with many held loans, ScheduledInvestor
+            computes each loan's cashflows once at purchase
+        :param month_index: MonthIndex of db, by default shared with every other Backtest on the same db
+        :param dummies: list, state_*/purpose_* columns the solver reads, rebuilt on each month's loans
+            when db was compacted with pack_dummies
+        :param instrument: Instrument, times the phases of every month and counts loans, off by default
+        '''
+        self.investor = investor_class(cash)
         self.month = pd.Period(sdate, freq='M')
         self.end_month = pd.Period(edate, freq='M')
         self.buy_solver = buy_solver
         self.db = db
+        if month_index is None:
+            month_index = get_month_index(db) if isinstance(db, pd.DataFrame) else db
+        self.month_index = month_index
         self.buy_size = buy_size
         self.liquidity_limit = liquidity_limit
+        self.dummies = dummies
+        self.instrument = instrument or null_instrument
 
         self.buy_solver_name = self.buy_solver_lookup(self.buy_solver)
+        if hasattr(self.buy_solver, 'compile'):
+            # declarative solvers (RankedSolver) precompute their masks and ranks over db once
+            self.buy_solver.compile(self.month_index)
         
         self.stats = defaultdict(dict)
-        self.loans = pd.DataFrame()
-        self.current_loans = dict()
+        self.history = HoldingsLog()
+        self.loans_bought = 0
+        self.stopped = None
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if key not in self.shared_state}
 
     def buy_solver_lookup(self, function):
-        return {
-            simple_filter_buy_solver: 'Simple Filter',
-            generic_buy_solver: 'Generic n-Loan',
-            single_buy_solver: 'Single Buy',
-            zero_buy_solver: 'Zero Buy'
-        }[function]
+        return solver_name(function)
     
-    def solve_month(self):
-        self.investor.get_payments()
-        new_loans, matching_new_loans, available_new_loans = self.buy()
-        
-        self.loans = pd.concat([self.loans, new_loans], axis=0)
-        self.current_loans[self.month] = [loan for loan in self.investor.loans]
-        self.stats['loans added'][self.month] = new_loans.shape[0]
-        self.stats['strategy available loans'][self.month] = matching_new_loans
-        self.stats['available loans'][self.month] = available_new_loans
-        self.stats['loans held'][self.month] = len(self.investor.loans)
-        self.stats['cumulative loans held'][self.month] = self.loans.shape[0]
-        self.stats['cumulative defaults'][self.month] = self.investor.cum_defaults
-        self.stats['cash held'][self.month] = self.investor.balance
-        self.stats['net worth'][self.month] = self.investor.get_net_worth()
-        self.stats['imbalance'][self.month] = self.investor.cum_imbalance
-        self.stats['abs imbalance'][self.month] = self.investor.abs_cum_imbalance
-        self.stats['imbalance %'][self.month] = self.stats['imbalance'][self.month] / self.stats['net worth'][self.month]
-        self.stats['abs imbalance %'][self.month] = self.stats['abs imbalance'][self.month] / self.stats['net worth'][self.month]
-        
+    def solve_month(self, record=True, month_db=None):
+        '''
+        Solves the current month and moves on to the next.
+        :param record: bool, keep the month's stats and loans for the end of run results
+        :param month_db: pandas.DataFrame, the month's loans when already sliced (see MultiBacktest)
+        returns: dict, the month's stats
+        '''
+        instrument = self.instrument
+        instrument.start_month(self.month)
+        with instrument.phase('month'):
+            row = self._solve_month(instrument, record, month_db)
         self.month += 1
-        
-    def buy(self):
-        month_db = self.db[self.db['issue_d'] == self.month]
-        purchase_count = np.floor(self.investor.balance / self.buy_size)
-        # if purchase_count > 0: ### We can just pass 0 to the solver and get back an empty dataframe for now
-        buy_dict = self.buy_solver(self.month, self.investor, month_db, purchase_count, self.liquidity_limit)
+        return row
+
+    def _solve_month(self, instrument, record, month_db):
+        completed = self.receive_payments(record)
+        with instrument.phase('buy'):
+            new_loans, matching_new_loans, available_new_loans = self.buy(month_db)
+        return self.close_month(new_loans, matching_new_loans, available_new_loans, record, len(completed))
+
+    def receive_payments(self, record=True):
+        '''
+        The first step of a month: the held loans' payments.
+        returns: purchase positions of the loans that completed
+        '''
+        instrument = self.instrument
+        balance = self.investor.balance
+        with instrument.phase('payments'):
+            completed, completed_ratios = self.investor.get_payments()
+        if record:
+            with instrument.phase('history'):
+                self.history.record_payments(self.month, self.investor.balance - balance)
+                self.history.record_completions(self.month, completed, completed_ratios)
+        return completed
+
+    def close_month(self, new_loans, matching_new_loans, available_new_loans, record=True, completed=0):
+        '''
+        The last step of a month, once its loans are bought: its history and stats.
+        returns: dict, the month's stats
+        '''
+        instrument = self.instrument
+        self.loans_bought += len(new_loans['id'])
+        if record:
+            with instrument.phase('history'):
+                self.history.record_buys(self.month, new_loans)
+        if instrument.enabled:
+            instrument.count('loans completed', completed)
+            instrument.count('loans bought', len(new_loans['id']))
+            instrument.count('loans held', len(self.investor.loans))
+            instrument.count('matching loans', matching_new_loans)
+            instrument.count('available loans', available_new_loans)
 
-        buy_df = buy_dict['loans']
-        buy_matching = buy_dict['matching quantity']
-        buy_available = buy_dict['available quantity']
+        with instrument.phase('stats'):
+            row = self.month_stats(new_loans, matching_new_loans, available_new_loans)
+            if record:
+                for key, value in row.items():
+                    self.stats[key][self.month] = value
+        return row
 
-        if buy_df.empty:
-            buy_df = pd.DataFrame()
+    def month_stats(self, new_loans, matching_new_loans, available_new_loans):
+        row = OrderedDict()
+        row['loans added'] = len(new_loans['id'])
+        row['strategy available loans'] = matching_new_loans
+        row['available loans'] = available_new_loans
+        row['loans held'] = len(self.investor.loans)
+        row['cumulative loans held'] = self.loans_bought
+        row['cumulative defaults'] = self.investor.cum_defaults
+        row['cash held'] = self.investor.balance
+        row['net worth'] = self.investor.get_net_worth()
+        row['imbalance'] = self.investor.cum_imbalance
+        row['abs imbalance'] = self.investor.abs_cum_imbalance
+        row['imbalance %'] = row['imbalance'] / row['net worth']
+        row['abs imbalance %'] = row['abs imbalance'] / row['net worth']
+        return row
+        
+    def month_slice(self):
+        month_db = self.month_index.get(self.month)
+        if self.dummies:
+            month_db = with_dummies(month_db, self.dummies)
+        return month_db
+
+    def buy(self, month_db=None):
+        instrument = self.instrument
+        if month_db is None:
+            with instrument.phase('month slice'):
+                month_db = self.month_slice()
+        purchase_count = int(np.floor(self.investor.balance / self.buy_size))
+        buy_dict = self.choose(month_db, purchase_count)
+        new_loans = self.take(buy_dict['loans'])
+        return new_loans, buy_dict['matching quantity'], buy_dict['available quantity']
 
-        new_loans = buy_df.apply(self.map_loan_row, axis=1)
+    def choose(self, month_db, number):
+        '''
+        The solver's pick of at most number loans of month_db, see generic_buy_solver.
+        '''
+        # if purchase_count > 0: ### We can just pass 0 to the solver and get back an empty dataframe for now
+        with self.instrument.phase('solver'):
+            if hasattr(self.buy_solver, 'select'):
+                # compiled solvers read the arrays of this backtest's own MonthIndex
+                return self.buy_solver.select(self.month_index, self.month, self.investor, month_db, number,
+                                              self.liquidity_limit)
+            return self.buy_solver(self.month, self.investor, month_db, number, self.liquidity_limit)
 
-        self.investor.buy_loans(new_loans)
-        return new_loans, buy_matching, buy_available   
+    def take(self, buy_df, investment=None):
+        '''
+        Buys the loans of buy_df.
+        :param investment: float or array of one per loan, buy_size by default
+        returns: dict, the loan_batch bought
+        '''
+        with self.instrument.phase('loan batch'):
+            new_loans = loan_batch(buy_df, self.buy_size if investment is None else investment)
+        with self.instrument.phase('investor buy'):
+            self.investor.buy_batch(new_loans)
+        return new_loans
 
     
     def map_loan_row(self, row):
@@ -88,52 +194,179 @@ class Backtest():
             recoveries=row['recoveries']
         )
         
-    def run(self):
-        while self.month <= self.end_month:
+    def run_until(self, month, checkpoint_path=None, checkpoint_every=12):
+        '''
+        Solves the months up to and including month, leaving the run open to be continued,
+        checkpointed or forked.
+        :param checkpoint_path: str, checkpoint here every checkpoint_every months and at month
+        '''
+        month = min(pd.Period(month, freq='M'), self.end_month)
+        solved = 0
+        while self.month <= month:
             print self.month, self.end_month
             self.solve_month()
-            
-        self.stats = pd.DataFrame(self.stats)
-        self.stats['defaults'] = self.stats['cumulative defaults'].diff()
-        self.stats['monthly return'] = self.stats['net worth'].diff().shift(-1) / self.stats['net worth']
-        self.stats['annualized return'] = self.stats['monthly return'].resample('A', how='mean').resample('M', fill_method='ffill')
-        self.stats['total liquidity'] = self.stats['loans added'] / self.stats['available loans']
-        self.stats['strategy liquidity'] = self.stats['loans added'] / self.stats['strategy available loans'].replace(0, np.nan)
-        self.stats['strategy vs total liquidity'] = self.stats['strategy available loans'] / self.stats['available loans'].replace(0, np.nan)
-        self.stats['default rate'] = self.stats['defaults'] / self.stats['loans held'].replace(0, np.nan)
-        self.stats['growth of $1'] = self.stats['net worth'] / self.stats['net worth'].iloc[0]
-        
-        self.stats_dict = dict()
-
-        try:
-            self.stats_dict['sharpe'] = self.stats['net worth'].diff().mean() / self.stats['net worth'].diff().std() * np.sqrt(12)
-        except ZeroDivisionError as e:
-            warnings.warn('Division by zero: Sharpe Ratio')
-            self.stats_dict['sharpe'] = np.nan
-
-        self.stats_dict = pd.Series(self.stats_dict)
-
-        self.loan_stats = dict()
-        self.current_loans = {month: pd.DataFrame([loan.to_dict() for loan in self.current_loans[month]]) for month in self.current_loans}
-        self.loan_stats['grade'] = pd.DataFrame({month: self.current_loans[month]['grade'].value_counts() for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index)
-        self.loan_stats['grade_int_rate'] = pd.DataFrame({month: self.current_loans[month].groupby('grade')['int_rate'].mean() for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index)
-        self.loan_stats['duration'] = pd.DataFrame({month: (self.current_loans[month]['end_date'] - month) for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index) / 12
-        self.loan_stats['int_rate'] = pd.DataFrame({month: self.current_loans[month]['int_rate'] for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index)
-        self.loan_stats['defaulted'] = pd.DataFrame({month: self.current_loans[month]['defaulted'] for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index)
-        self.loan_stats['remaining_amount'] = pd.DataFrame({month: self.current_loans[month]['remaining_amount'] for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index)
-        self.loan_stats['imbalance_percentage'] = pd.DataFrame({month: self.current_loans[month]['imbalance_percentage'] for month in self.current_loans if not self.current_loans[month].empty}).T.reindex(self.stats.index)
-
-        self.loan_stats_total = dict()
-        for category in ['duration', 'int_rate', 'imbalance_percentage']: # self.loan_stats:
-            self.loan_stats_total[category] = pd.Series(self.loan_stats[category].values.flatten()).dropna()
-
-        self.loan_stats_total['imbalance_percentage'] = pd.Series(self.loan_stats_total['imbalance_percentage'].value_counts().index) # small hack to remove duplicates between months
+            solved += 1
+            if checkpoint_path and (solved % checkpoint_every == 0 or self.month > month):
+                self.checkpoint(checkpoint_path)
+        return self
+
+    def checkpoint(self, filepath):
+        '''
+        Saves the state of an unfinished run (investor, holdings log, stats so far and the
+        month to solve next), see resume. The db, month index and instrument are not saved.
+        '''
+        if isinstance(self.stats, pd.DataFrame):
+            raise ValueError('cannot checkpoint a finished run, checkpoint before run or with run_until')
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump(self, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, filepath)
+
+    @classmethod
+    def resume(cls, filepath, db, month_index=None, instrument=None, **overrides):
+        '''
+        A Backtest continuing from a checkpoint, db must be the db the checkpoint was run on.
+        :param overrides: settings to change from here on, see set_params
+        '''
+        with open(filepath, 'rb') as fp:
+            bt = pickle.load(fp)
+        bt.db = db
+        if month_index is None:
+            month_index = get_month_index(db) if isinstance(db, pd.DataFrame) else db
+        bt.month_index = month_index
+        bt.instrument = instrument or null_instrument
+        if hasattr(bt.buy_solver, 'compile'):
+            bt.buy_solver.compile(bt.month_index)
+        return bt.set_params(**overrides)
+
+    def fork(self, instrument=None, **overrides):
+        '''
+        An independent copy of this unfinished run sharing its db, to continue with other
+        settings, e.g. several continuations of one common prefix.
+        :param overrides: settings to change from here on, see set_params
+        '''
+        if isinstance(self.stats, pd.DataFrame):
+            raise ValueError('cannot fork a finished run, fork before run or with run_until')
+        # solvers keep no state of a run, only what they precomputed over db
+        bt = copy.deepcopy(self, {id(self.buy_solver): self.buy_solver})
+        bt.db = self.db
+        bt.month_index = self.month_index
+        bt.instrument = instrument or null_instrument
+        return bt.set_params(**overrides)
+
+    def set_params(self, edate=None, buy_solver=None, **settings):
+        '''
+        Changes settings of an unfinished run for the months still to solve.
+        :param edate: new last month
+        :param buy_solver: new solver
+        :param settings: buy_size, liquidity_limit or dummies
+        '''
+        if edate is not None:
+            self.end_month = pd.Period(edate, freq='M')
+        if buy_solver is not None:
+            self.buy_solver = buy_solver
+            self.buy_solver_name = self.buy_solver_lookup(buy_solver)
+            if hasattr(buy_solver, 'compile'):
+                buy_solver.compile(self.month_index)
+        for key, value in settings.items():
+            if key not in ['buy_size', 'liquidity_limit', 'dummies']:
+                raise TypeError('unknown Backtest setting {}'.format(key))
+            setattr(self, key, value)
+        return self
+
+    def run(self, checkpoint_path=None, checkpoint_every=12):
+        '''
+        Solves the remaining months and computes the stats.
+        :param checkpoint_path: str, checkpoint the run there every checkpoint_every months, see resume
+        '''
+        self.run_until(self.end_month, checkpoint_path, checkpoint_every)
+        return self.finish()
+
+    def stream(self, stop=None, record=True):
+        '''
+        Solves the remaining months one at a time, yielding each month's stats as soon as it is
+        solved, with the stats run derives at the end kept up to date by OnlineStats.
+
+            for row in bt.stream(stop=stop_on_drawdown(0.2)):
+                print row['month'], row['net worth'], row['sharpe']
+
+        :param stop: callable, given each row, the run stops after the first row it returns True for
+            (see the rules in streaming), bt.stopped is then that row's month
+        :param record: bool, keep the stats and loan history for finish(), off to keep the
+            backtest's memory from growing with the months and loans solved
+        '''
+        online = OnlineStats()
+        self.stopped = None
+        while self.month <= self.end_month:
+            month = self.month
+            row = online.update(month, self.solve_month(record))
+            yield row
+            if stop is not None and stop(row):
+                self.stopped = month
+                return
+
+    def finish(self):
+        '''
+        The end of run stats, loan_stats and loan_stats_total of the months solved so far.
+        '''
+        instrument = self.instrument
+        instrument.start_month(None)
+        with instrument.phase('stats frame'):
+            self.stats = pd.DataFrame(self.stats)
+            self.stats['defaults'] = self.stats['cumulative defaults'].diff()
+            self.stats['monthly return'] = self.stats['net worth'].diff().shift(-1) / self.stats['net worth']
+            self.stats['annualized return'] = self.stats['monthly return'].resample('A', how='mean').resample('M', fill_method='ffill')
+            self.stats['total liquidity'] = self.stats['loans added'] / self.stats['available loans']
+            self.stats['strategy liquidity'] = self.stats['loans added'] / self.stats['strategy available loans'].replace(0, np.nan)
+            self.stats['strategy vs total liquidity'] = self.stats['strategy available loans'] / self.stats['available loans'].replace(0, np.nan)
+            self.stats['default rate'] = self.stats['defaults'] / self.stats['loans held'].replace(0, np.nan)
+            self.stats['growth of $1'] = self.stats['net worth'] / self.stats['net worth'].iloc[0]
         
-        self.loan_stats_total['grade'] = self.loan_stats['grade'].sum()
+            self.stats_dict = dict()
+
+            try:
+                self.stats_dict['sharpe'] = self.stats['net worth'].diff().mean() / self.stats['net worth'].diff().std() * np.sqrt(12)
+            except ZeroDivisionError as e:
+                warnings.warn('Division by zero: Sharpe Ratio')
+                self.stats_dict['sharpe'] = np.nan
+
+            self.stats_dict = pd.Series(self.stats_dict)
 
+        with instrument.phase('holdings table'):
+            self.loan_stats = dict()
+            self.loan_stats_total = dict()
+            self.holdings_table = self.history.holdings_table(self.stats.index[0], self.stats.index[-1])
+        with instrument.phase('loan stats'):
+            table = self.holdings_table
+            wide_columns = ['duration', 'int_rate', 'defaulted', 'remaining_amount', 'imbalance_percentage']
+            if table.empty:
+                for category in ['grade', 'grade_int_rate'] + wide_columns:
+                    self.loan_stats[category] = pd.DataFrame(index=self.stats.index)
+            else:
+                table['duration'] = (table['end_month'] - table['month']) / 12.0
+                by_grade = table.groupby(['month', 'grade'])['int_rate'].agg(['size', 'mean'])
+                wide = table.set_index(['month', 'position'])[wide_columns].unstack('position')
+                self.loan_stats['grade'] = label_months(by_grade['size'].unstack(), self.stats.index)
+                self.loan_stats['grade_int_rate'] = label_months(by_grade['mean'].unstack(), self.stats.index)
+                for category in wide_columns:
+                    self.loan_stats[category] = label_months(wide[category], self.stats.index)
+
+            for category in ['duration', 'int_rate', 'imbalance_percentage']:
+                self.loan_stats_total[category] = pd.Series(self.loan_stats[category].values.flatten()).dropna()
+
+            # each completed loan's imbalance once
+            self.loan_stats_total['imbalance_percentage'] = pd.Series(self.history.completed_imbalance_ratios())
+        
+            self.loan_stats_total['grade'] = self.loan_stats['grade'].sum()
             
         return self.stats
 
+    def holdings(self, month):
+        '''
+        The loans held at the end of month as a DataFrame, rebuilt from self.history.
+        '''
+        return self.history.holdings(pd.Period(month, freq='M'))
+
     def generate_report(self):
         pass
 
@@ -178,6 +411,7 @@ def generic_buy_solver(month, investor, month_db, number, liquidity_limit):
         available: int, the number of loans available in month_db
     }
     '''
+    return_df = month_db
     matching_quantity = month_db.shape[0]
     available_quantity = month_db.shape[0]
     print 'available ', available_quantity
@@ -212,4 +446,21 @@ def zero_buy_solver(month, investor, month_db, number, liqudity_limit):
     }
     return return_dict
     
-            
\ No newline at end of file
+            
+
+
+def label_months(frame, months):
+    # index a frame keyed by Period ordinals by the months of the backtest
+    frame = frame.copy()
+    frame.index = [pd.Period(ordinal=ordinal, freq='M') for ordinal in frame.index]
+    frame.columns.name = None
+    return frame.reindex(months)
+
+
+def solver_name(function):
+    return {
+        simple_filter_buy_solver: 'Simple Filter',
+        generic_buy_solver: 'Generic n-Loan',
+        single_buy_solver: 'Single Buy',
+        zero_buy_solver: 'Zero Buy'
+    }.get(function, getattr(function, 'name', None) or getattr(function, '__name__', repr(function)))
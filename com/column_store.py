@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from month_index import month_ordinals
+
+# ordinal written for missing Periods
+NULL_ORDINAL = np.iinfo(np.int64).min
+
+
+def _column_kind(values):
+    if hasattr(values, 'cat'):
+        return 'category'
+    if values.dtype != object:
+        return 'plain'
+    present = values.dropna()
+    if len(present) and all(isinstance(value, pd.Period) for value in present.iloc[:100]):
+        return 'period'
+    return 'object'
+
+
+def write_frame(df, path, sort_by=None):
+    '''
+    Writes df as a directory of one .npy file per column plus a meta.json.
+
+    Numeric and bool columns are stored as they are, Periods as int64 ordinals and
+    text as integer codes with a small table of values, so every column can be
+    memory mapped on load. With sort_by (a Period column) rows are stably sorted
+    by it and read_frame can select a date range by slicing.
+    '''
+    if sort_by is not None:
+        df = df.iloc[np.argsort(_period_ordinals(df[sort_by]), kind='mergesort')]
+
+    tmp_path = path.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    meta = {'rows': len(df), 'sort_by': sort_by, 'columns': []}
+    np.save(os.path.join(tmp_path, 'index.npy'), np.asarray(df.index))
+    for number, name in enumerate(df.columns):
+        values = df[name]
+        kind = _column_kind(values)
+        entry = {'name': name, 'kind': kind, 'file': '{}.npy'.format(number)}
+        if kind == 'plain':
+            data = values.values
+        elif kind == 'period':
+            data = _period_ordinals(values)
+            entry['freq'] = values.dropna().iloc[0].freqstr if values.notnull().any() else 'M'
+        elif kind == 'category':
+            data = values.cat.codes.values
+            np.save(os.path.join(tmp_path, '{}.values.npy'.format(number)), np.asarray(values.cat.categories, dtype=object))
+        else:
+            data, uniques = pd.factorize(values)
+            np.save(os.path.join(tmp_path, '{}.values.npy'.format(number)), np.asarray(uniques, dtype=object))
+        np.save(os.path.join(tmp_path, entry['file']), data)
+        meta['columns'].append(entry)
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as fp:
+        json.dump(meta, fp, indent=2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def _period_ordinals(values):
+    return month_ordinals([value if value is not None and value == value else _NullPeriod for value in values])
+
+
+class _NullPeriod():
+    ordinal = NULL_ORDINAL
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as fp:
+        return json.load(fp)
+
+
+def read_frame(path, columns=None, sdate=None, edate=None, mmap=True):
+    '''
+    Loads a frame written by write_frame.
+
+    :param columns: list, columns to load, all by default
+    :param sdate, edate: first and last month to load (inclusive), needs a frame written with sort_by
+    :param mmap: bool, memory map the column files instead of reading them
+    '''
+    meta = read_meta(path)
+    mmap_mode = 'r' if mmap else None
+    entries = meta['columns']
+    if columns is not None:
+        wanted = set(columns)
+        entries = [entry for entry in entries if entry['name'] in wanted]
+
+    rows = slice(0, meta['rows'])
+    if sdate is not None or edate is not None:
+        sort_entry = [entry for entry in meta['columns'] if entry['name'] == meta['sort_by']][0]
+        ordinals = _load(os.path.join(path, sort_entry['file']), mmap_mode)
+        start = 0 if sdate is None else np.searchsorted(ordinals, pd.Period(sdate, freq='M').ordinal, 'left')
+        stop = len(ordinals) if edate is None else np.searchsorted(ordinals, pd.Period(edate, freq='M').ordinal, 'right')
+        rows = slice(start, stop)
+
+    data = dict()
+    for entry in entries:
+        values = _load(os.path.join(path, entry['file']), mmap_mode)[rows]
+        data[str(entry['name'])] = _decode(path, entry, values)
+    index = _load(os.path.join(path, 'index.npy'), mmap_mode)[rows]
+    names = [str(entry['name']) for entry in entries]
+    return pd.DataFrame(data, index=np.asarray(index), columns=names)
+
+
+def _load(filepath, mmap_mode):
+    try:
+        return np.load(filepath, mmap_mode=mmap_mode)
+    except ValueError:
+        # object arrays (e.g. a text index) cannot be memory mapped
+        return np.load(filepath, allow_pickle=True)
+
+
+def _decode(path, entry, values):
+    kind = entry['kind']
+    if kind == 'plain':
+        return values
+    if kind == 'period':
+        uniques, inverse = np.unique(values, return_inverse=True)
+        periods = np.array([None if ordinal == NULL_ORDINAL else pd.Period(ordinal=ordinal, freq=entry['freq'])
+                            for ordinal in uniques], dtype=object)
+        return periods[inverse]
+    uniques = np.load(os.path.join(path, entry['file'].replace('.npy', '.values.npy')), allow_pickle=True)
+    if kind == 'category':
+        return pd.Categorical.from_codes(np.asarray(values), uniques)
+    decoded = np.append(uniques, np.nan).astype(object)
+    return decoded[np.asarray(values)]
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# dummy column prefix -> the text column the dummies were made from
+dummy_sources = {'state_': 'addr_state', 'purpose_': 'purpose'}
+
+# read by Backtest / Loan, kept at full precision so backtest stats are unchanged
+full_precision_columns = ['id', 'member_id', 'int_rate', 'funded_amnt', 'total_pymnt', 'total_rec_prncp',
+                          'recoveries', 'defaulted']
+
+
+def is_dummy(column):
+    return any(column.startswith(prefix) for prefix in dummy_sources)
+
+
+def _smallest_int(values):
+    if not len(values):
+        return values.dtype
+    low, high = values.min(), values.max()
+    for dtype in [np.int8, np.int16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return np.int64
+
+
+def compact_frame(df, pack_dummies=False, max_category_ratio=0.5):
+    '''
+    A copy of the historic frame with a much smaller memory footprint.
+
+    - text columns with few distinct values become categoricals
+    - state_*/purpose_* dummies become int8, or with pack_dummies are dropped and
+      rebuilt on demand from the addr_state/purpose categoricals (see with_dummies)
+    - floats become float32 and ints the smallest int that holds them, except for
+      full_precision_columns
+    '''
+    columns = []
+    for column in df.columns:
+        values = df[column]
+        if is_dummy(column):
+            if pack_dummies:
+                continue
+            values = values.astype(np.int8)
+        elif column in full_precision_columns or values.dtype == bool:
+            pass
+        elif values.dtype.kind == 'f':
+            values = values.astype(np.float32)
+        elif values.dtype.kind in 'iu':
+            values = values.astype(_smallest_int(values))
+        elif values.dtype == object:
+            present = values.dropna()
+            if len(present) and not isinstance(present.iloc[0], pd.Period) \
+                    and present.nunique() <= max_category_ratio * len(values):
+                values = values.astype('category')
+        columns.append(values)
+    return pd.concat(columns, axis=1)
+
+
+def with_dummies(df, columns=None):
+    '''
+    Adds state_*/purpose_* dummy columns (int8) rebuilt from addr_state/purpose.
+
+    Meant for month slices of a frame compacted with pack_dummies, so solvers can keep
+    using e.g. month_db['state_CA'].
+    :param columns: list, dummy columns to add, by default one per category of the source columns
+    '''
+    if columns is None:
+        columns = []
+        for prefix, source in sorted(dummy_sources.items()):
+            values = df[source]
+            categories = values.cat.categories if hasattr(values, 'cat') else sorted(values.dropna().unique())
+            columns.extend(prefix + category for category in categories)
+    dummies = dict()
+    for column in columns:
+        if column in df.columns:
+            continue
+        prefix = [prefix for prefix in dummy_sources if column.startswith(prefix)][0]
+        values, value = df[dummy_sources[prefix]], column[len(prefix):]
+        if hasattr(values, 'cat'):
+            categories = values.cat.categories
+            code = categories.get_loc(value) if value in categories else -2
+            dummies[column] = (values.cat.codes.values == code).astype(np.int8)
+        else:
+            dummies[column] = (values.values == value).astype(np.int8)
+    if not dummies:
+        return df
+    return pd.concat([df, pd.DataFrame(dummies, index=df.index, columns=[c for c in columns if c in dummies])], axis=1)
+
+
+def memory_usage(df):
+    return df.memory_usage(index=True, deep=True).sum()
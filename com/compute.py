@@ -0,0 +1,22 @@
+'''
+The backtesting classes without plotting or reporting, for pool workers and batch jobs.
+
+    from com.compute import Backtest, RankedSolver, PortfolioInvestor
+
+Only NumPy and pandas are imported. lc_helpers (data loading) and report (matplotlib and
+jinja2, loaded when a report is saved) stay out of the process unless imported.
+'''
+from backtest import (Backtest, simple_filter_buy_solver, generic_buy_solver, single_buy_solver,
+                      zero_buy_solver, solver_name)
+from column_store import read_frame
+from instrument import Instrument, Probe
+from investor import Investor, PortfolioInvestor, ScheduledInvestor
+from loan import Loan, loan_batch, loan_columns
+from market import MarketBacktest, allocate, match
+from month_index import MonthIndex, get_month_index
+from multi import MultiBacktest
+from partitioned import PartitionedSource
+from scenarios import ScenarioBacktest
+from solvers import RankedSolver, simple_filter_solver
+from streaming import OnlineStats, stop_on_drawdown, stop_below_net_worth, stop_below_sharpe, stop_any
+from sweep import run_sweep, parameter_grid
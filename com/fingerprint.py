@@ -0,0 +1,87 @@
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def file_fingerprint(path, chunk_size=2 ** 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def code_fingerprint(*objects):
+    '''
+    Hash of the source of functions, classes and modules (repr for anything else),
+    so cached results can be invalidated when the code producing them changes.
+    '''
+    sha = hashlib.sha1()
+    for obj in objects:
+        try:
+            source = inspect.getsource(obj)
+        except (TypeError, IOError):
+            source = repr(obj)
+        sha.update(_encode(source))
+    return sha.hexdigest()
+
+
+def _encode(text):
+    return text.encode('utf-8') if not isinstance(text, bytes) else text
+
+
+def frame_fingerprint(df, columns=None):
+    '''
+    Hash of a DataFrame's index, column names, dtypes and values, e.g. to key results
+    computed from the historic table. Period columns are hashed as their ordinals and other
+    object columns as their distinct values and pd.factorize codes, not a repr per row.
+
+    :param columns: list, only hash these columns (the ones a computation reads)
+    '''
+    sha = hashlib.sha1()
+    columns = list(df.columns) if columns is None else list(columns)
+    for name, values in [('index', df.index.values)] + [(column, df[column].values) for column in columns]:
+        sha.update(_encode(repr((str(name), str(values.dtype), len(values)))))
+        if hasattr(values, 'categories'):
+            sha.update(_encode(repr(list(values.categories))))
+            values = values.codes
+        if values.dtype == object and pd.lib.infer_dtype(values) == 'period':
+            sha.update(_encode(values[pd.notnull(values)][0].freqstr))
+            missing = np.iinfo(np.int64).min
+            values = np.array([getattr(value, 'ordinal', missing) for value in values], dtype=np.int64)
+        elif values.dtype == object:
+            values, uniques = pd.factorize(values)
+            sha.update(_encode('\0'.join(repr(value) for value in uniques)))
+        sha.update(np.ascontiguousarray(values).view(np.uint8))
+    return sha.hexdigest()
+
+
+class FileFingerprints():
+    '''
+    File content hashes remembered by size and modification time, so unchanged files
+    are not re-read on every call.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.entries = json.load(fp)
+
+    def get(self, filepath):
+        stat = os.stat(filepath)
+        key = os.path.abspath(filepath)
+        entry = self.entries.get(key)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_fingerprint(filepath)}
+            self.entries[key] = entry
+            self.save()
+        return entry['sha1']
+
+    def save(self):
+        with open(self.path, 'w') as fp:
+            json.dump(self.entries, fp, indent=2, sort_keys=True)
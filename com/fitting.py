@@ -0,0 +1,457 @@
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from compact import dummy_sources, with_dummies
+
+# filled in before the pool forks, see sweep
+_shared = dict()
+
+
+def _dummy_source(df, column):
+    '''
+    (source column, value) of a state_/purpose_ dummy whose source column is in df.
+    '''
+    for prefix, source in dummy_sources.items():
+        if column.startswith(prefix) and source in df.columns:
+            return source, column[len(prefix):]
+    return None
+
+
+def _design(df, columns):
+    '''
+    Float matrix of columns, rebuilding dummies df does not have (see with_dummies).
+    '''
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        df = with_dummies(df, missing)
+    return np.column_stack([np.asarray(df[column], dtype=float) for column in columns]) if columns \
+        else np.zeros((len(df), 0))
+
+
+def _label(factors):
+    return ' + '.join(factors) if factors else '(intercept)'
+
+
+class FactorGram():
+    '''
+    Cross products of an intercept, the factors and the target, summed per group of rows
+    (issue month by default): all an OLS fit or its out of sample error needs, for any subset
+    of the factors and any range of months.
+
+    ``matrices[g]`` is X'X of the group's rows with X = [1, factors..., y]. Rows missing the
+    target or a numeric factor are left out, so every model fits the same sample. State and
+    purpose dummies are never expanded into float columns: their blocks are counts and group
+    sums over the codes of addr_state / purpose.
+    :param by: column to group rows by, None for a single group
+    '''
+    def __init__(self, df, y, factors, by='issue_d'):
+        self.y = y
+        self.factors = list(factors)
+        self.columns = ['intercept'] + self.factors + [y]
+        self.positions = dict((column, position) for position, column in enumerate(self.columns))
+
+        dense, families = [0], dict()
+        for position, column in enumerate(self.columns[1:], 1):
+            source = _dummy_source(df, column) if column != y else None
+            if source is None:
+                dense.append(position)
+            else:
+                families.setdefault(source[0], []).append((position, source[1]))
+        values = np.column_stack([np.ones(len(df))] +
+                                 [np.asarray(df[self.columns[position]], dtype=float) for position in dense[1:]])
+        keep = ~np.isnan(values).any(axis=1)
+
+        if by is None:
+            group_codes, self.groups = np.zeros(len(df), dtype=np.int64), [None]
+        else:
+            group_codes, groups = pd.factorize(df[by])
+            keep &= group_codes >= 0
+            order = np.argsort(np.asarray(groups, dtype=object), kind='mergesort')
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            group_codes = np.where(group_codes >= 0, rank[np.maximum(group_codes, 0)], -1)
+            self.groups = list(np.asarray(groups, dtype=object)[order])
+        self.keep = keep
+        # group of each kept row, positions in groups
+        self.codes = groups = group_codes[keep]
+        values = values[keep]
+        count, size = len(self.groups), len(self.columns)
+
+        self.matrices = np.zeros((count, size, size))
+        order = np.argsort(groups, kind='mergesort')
+        bounds = np.searchsorted(groups[order], np.arange(count + 1))
+        dense_block = np.ix_(dense, dense)
+        for group in range(count):
+            rows = values[order[bounds[group]:bounds[group + 1]]]
+            self.matrices[group][dense_block] = rows.T.dot(rows)
+
+        codes = dict()
+        for source, dummies in families.items():
+            source_codes, categories = pd.factorize(df[source])
+            source_codes = source_codes[keep]
+            present = source_codes >= 0
+            categories = list(categories)
+            width = len(categories)
+            cells = groups[present] * width + source_codes[present]
+            counts = np.bincount(cells, minlength=count * width).reshape(count, width)
+            sums = [np.bincount(cells, weights=values[present, column], minlength=count * width).reshape(count, width)
+                    for column in range(len(dense))]
+            for position, value in dummies:
+                if value not in categories:
+                    continue
+                category = categories.index(value)
+                self.matrices[:, position, position] = counts[:, category]
+                for column, dense_position in enumerate(dense):
+                    self.matrices[:, position, dense_position] = sums[column][:, category]
+                    self.matrices[:, dense_position, position] = sums[column][:, category]
+            codes[source] = (source_codes, width, dict((position, categories.index(value)) for position, value
+                                                       in dummies if value in categories))
+
+        sources = sorted(codes)
+        for first_number, first in enumerate(sources):
+            for second in sources[first_number + 1:]:
+                first_codes, first_width, first_dummies = codes[first]
+                second_codes, second_width, second_dummies = codes[second]
+                present = (first_codes >= 0) & (second_codes >= 0)
+                cells = (groups[present] * first_width + first_codes[present]) * second_width + second_codes[present]
+                joint = np.bincount(cells, minlength=count * first_width * second_width) \
+                    .reshape(count, first_width, second_width)
+                for first_position, first_category in first_dummies.items():
+                    for second_position, second_category in second_dummies.items():
+                        self.matrices[:, first_position, second_position] = joint[:, first_category, second_category]
+                        self.matrices[:, second_position, first_position] = joint[:, first_category, second_category]
+
+    def total(self, groups=None):
+        '''
+        The summed matrix of the chosen groups (a boolean mask or positions), all by default.
+        '''
+        return self.matrices.sum(axis=0) if groups is None else self.matrices[groups].sum(axis=0)
+
+    def subsets(self, factor_sets):
+        '''
+        returns: dict, number of factors -> (positions in factor_sets, column positions (models x k) with the intercept first)
+        '''
+        by_size = dict()
+        for number, factors in enumerate(factor_sets):
+            by_size.setdefault(len(factors), []).append(number)
+        return dict((size, (numbers, np.array([[0] + [self.positions[factor] for factor in factor_sets[number]]
+                                               for number in numbers], dtype=np.int64)))
+                    for size, numbers in by_size.items())
+
+
+def ols_batch(matrix, columns):
+    '''
+    Fits every row of columns (models x k positions of matrix, a FactorGram total) at once.
+
+    returns: (beta, models x k; inverse of the models' X'X; residual sum of squares)
+    '''
+    target = matrix.shape[-1] - 1
+    gram = matrix[columns[:, :, np.newaxis], columns[:, np.newaxis, :]]
+    xy = matrix[columns, target]
+    # equilibrate before inverting, counts of dummies and sums of incomes differ by orders of magnitude
+    scale = np.sqrt(np.einsum('mii->mi', gram))
+    scale[scale == 0] = 1.0
+    inverse = np.linalg.pinv(gram / scale[:, :, np.newaxis] / scale[:, np.newaxis, :])
+    inverse = inverse / scale[:, :, np.newaxis] / scale[:, np.newaxis, :]
+    beta = np.einsum('mij,mj->mi', inverse, xy)
+    sse = matrix[target, target] - np.einsum('mi,mi->m', beta, xy)
+    return beta, inverse, np.maximum(sse, 0)
+
+
+def ols_error(matrix, columns, beta):
+    '''
+    Residual sum of squares of fitted betas over the rows of another FactorGram total.
+    '''
+    target = matrix.shape[-1] - 1
+    gram = matrix[columns[:, :, np.newaxis], columns[:, np.newaxis, :]]
+    xy = matrix[columns, target]
+    sse = matrix[target, target] - 2 * np.einsum('mi,mi->m', beta, xy) + np.einsum('mi,mij,mj->m', beta, gram, beta)
+    return np.maximum(sse, 0)
+
+
+class FitResults():
+    '''
+    :attr summary: pandas.DataFrame, one row per model (labelled by its factors joined with +)
+    :attr coefficients: pandas.DataFrame, beta, std err and t stat per (model, factor)
+    '''
+    def __init__(self, summary, coefficients):
+        self.summary = summary
+        self.coefficients = coefficients
+
+    def best(self, metric='adj r2', number=10, ascending=False):
+        return self.summary.sort_values(metric, ascending=ascending).head(number)
+
+
+def fit_ols(df, y, factor_sets, gram=None):
+    '''
+    OLS of y on each set of factors (with an intercept), all from one shared FactorGram.
+
+    :param factor_sets: list of lists of columns
+    :param gram: FactorGram of y and every factor used, built when not given
+    returns: FitResults
+    '''
+    factor_sets = [list(factors) for factors in factor_sets]
+    if gram is None:
+        gram = FactorGram(df, y, sorted(set(sum(factor_sets, []))), by=None)
+    matrix = gram.total()
+    nobs = matrix[0, 0]
+    sst = matrix[-1, -1] - matrix[0, -1] ** 2 / nobs
+
+    rows, coefficients = [None] * len(factor_sets), [None] * len(factor_sets)
+    for size, (numbers, columns) in gram.subsets(factor_sets).items():
+        beta, inverse, sse = ols_batch(matrix, columns)
+        dof = nobs - size - 1
+        sigma2 = sse / dof
+        std_err = np.sqrt(np.maximum(np.einsum('mii->mi', inverse), 0) * sigma2[:, np.newaxis])
+        for model, number in enumerate(numbers):
+            factors = factor_sets[number]
+            r2 = 1 - sse[model] / sst
+            rows[number] = {'factors': size, 'nobs': int(nobs), 'r2': r2,
+                            'adj r2': 1 - (1 - r2) * (nobs - 1) / dof, 'rmse': np.sqrt(sse[model] / nobs),
+                            'aic': nobs * np.log(sse[model] / nobs) + 2 * (size + 1)}
+            coefficients[number] = pd.DataFrame({'beta': beta[model], 'std err': std_err[model],
+                                                 't stat': beta[model] / std_err[model]},
+                                                index=['intercept'] + factors, columns=['beta', 'std err', 't stat'])
+    labels = [_label(factors) for factors in factor_sets]
+    summary = pd.DataFrame(rows, index=labels, columns=['factors', 'nobs', 'r2', 'adj r2', 'rmse', 'aic'])
+    return FitResults(summary, pd.concat(coefficients, keys=labels, names=['model', 'factor']))
+
+
+def _expit(values):
+    return 1.0 / (1.0 + np.exp(-np.clip(values, -500, 500)))
+
+
+def logit_irls(X, y, start=None, max_iter=50, tol=1e-8):
+    '''
+    Logistic regression by Newton's method (iteratively reweighted least squares).
+
+    returns: (beta, inverse Hessian at beta, iterations)
+    '''
+    beta = np.zeros(X.shape[1]) if start is None else start.copy()
+    for iteration in range(1, max_iter + 1):
+        probability = _expit(X.dot(beta))
+        weights = probability * (1 - probability)
+        hessian = (X * weights[:, np.newaxis]).T.dot(X)
+        step = np.linalg.pinv(hessian).dot(X.T.dot(y - probability))
+        beta += step
+        if np.abs(step).max() < tol:
+            break
+    probability = _expit(X.dot(beta))
+    weights = probability * (1 - probability)
+    return beta, np.linalg.pinv((X * weights[:, np.newaxis]).T.dot(X)), iteration
+
+
+def _logit_start(matrix, columns):
+    '''
+    First Newton step of every model from the intercept-only fit, where all rows weigh the
+    same, so it only needs the shared FactorGram.
+    '''
+    nobs = matrix[0, 0]
+    rate = np.clip(matrix[0, -1] / nobs, 1e-9, 1 - 1e-9)
+    weight = rate * (1 - rate)
+    gram = matrix[columns[:, :, np.newaxis], columns[:, np.newaxis, :]]
+    gradient = matrix[columns, -1] - rate * matrix[columns, 0]
+    start = np.einsum('mij,mj->mi', np.linalg.pinv(gram * weight), gradient)
+    start[:, 0] += np.log(rate / (1 - rate))
+    return start
+
+
+def _log_loss(y, probability):
+    probability = np.clip(probability, 1e-15, 1 - 1e-15)
+    return -np.mean(y * np.log(probability) + (1 - y) * np.log(1 - probability))
+
+
+def auc(y, score):
+    '''
+    Area under the ROC curve, from the ranks of the scores (ties share their rank).
+    '''
+    positives = y.sum()
+    negatives = len(y) - positives
+    if not positives or not negatives:
+        return np.nan
+    ranks = pd.Series(score).rank().values
+    return (ranks[y == 1].sum() - positives * (positives + 1) / 2.0) / (positives * negatives)
+
+
+def _fit_logit_job(job):
+    columns, start, train, test = job
+    X, y = _shared['X'], _shared['y']
+    X_train = X[train][:, columns] if train is not None else X[:, columns]
+    y_train = y[train] if train is not None else y
+    beta, inverse, iterations = logit_irls(X_train, y_train, start)
+    probability = _expit(X_train.dot(beta))
+    result = {'beta': beta, 'inverse': inverse, 'iterations': iterations,
+              'log loss': _log_loss(y_train, probability), 'auc': auc(y_train, probability)}
+    if test is not None:
+        probability = _expit(X[test][:, columns].dot(beta))
+        result.update({'test log loss': _log_loss(y[test], probability), 'test auc': auc(y[test], probability),
+                       'test accuracy': np.mean((probability > 0.5) == (y[test] == 1))})
+    return result
+
+
+def _run_jobs(function, jobs, processes):
+    if processes == 1 or len(jobs) <= 1:
+        return [function(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(function, jobs, chunksize=max(1, len(jobs) // (4 * (processes or multiprocessing.cpu_count()))))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _logit_data(df, y, factor_sets, by):
+    factors = sorted(set(sum(factor_sets, [])))
+    gram = FactorGram(df, y, factors, by=by)
+    kept = df[gram.keep]
+    X = np.column_stack([np.ones(len(kept)), _design(kept, factors)])
+    return gram, X, np.asarray(kept[y], dtype=float)
+
+
+def fit_logit(df, y, factor_sets, processes=None):
+    '''
+    Logistic regression of y (0/1, e.g. defaulted) on each set of factors, the fits spread
+    over a pool of forked processes. Each starts from a Newton step computed from the shared
+    FactorGram, which usually leaves a few iterations to converge.
+
+    returns: FitResults, with log loss, auc and mcfadden r2 per model
+    '''
+    factor_sets = [list(factors) for factors in factor_sets]
+    gram, X, target = _logit_data(df, y, factor_sets, by=None)
+    matrix = gram.total()
+    jobs, numbers = [], []
+    for size, (models, columns) in gram.subsets(factor_sets).items():
+        starts = _logit_start(matrix, columns)
+        jobs.extend((columns[model], starts[model], None, None) for model in range(len(models)))
+        numbers.extend(models)
+
+    _shared.update(X=X, y=target)
+    try:
+        results = _run_jobs(_fit_logit_job, jobs, processes)
+    finally:
+        _shared.clear()
+
+    nobs = len(target)
+    rate = np.clip(target.mean(), 1e-15, 1 - 1e-15)
+    null_log_loss = -(rate * np.log(rate) + (1 - rate) * np.log(1 - rate))
+    rows, coefficients = [None] * len(factor_sets), [None] * len(factor_sets)
+    for number, result in zip(numbers, results):
+        factors = factor_sets[number]
+        std_err = np.sqrt(np.maximum(np.diag(result['inverse']), 0))
+        rows[number] = {'factors': len(factors), 'nobs': nobs, 'log loss': result['log loss'], 'auc': result['auc'],
+                        'mcfadden r2': 1 - result['log loss'] / null_log_loss,
+                        'aic': 2 * nobs * result['log loss'] + 2 * (len(factors) + 1),
+                        'iterations': result['iterations']}
+        coefficients[number] = pd.DataFrame({'beta': result['beta'], 'std err': std_err,
+                                             't stat': result['beta'] / std_err},
+                                            index=['intercept'] + factors, columns=['beta', 'std err', 't stat'])
+    labels = [_label(factors) for factors in factor_sets]
+    summary = pd.DataFrame(rows, index=labels,
+                           columns=['factors', 'nobs', 'log loss', 'auc', 'mcfadden r2', 'aic', 'iterations'])
+    return FitResults(summary, pd.concat(coefficients, keys=labels, names=['model', 'factor']))
+
+
+def time_splits(months, folds):
+    '''
+    Expanding window splits of sorted months: fold i trains on the first i blocks of months
+    and tests on the next one.
+
+    returns: list of (train positions, test positions)
+    '''
+    blocks = np.array_split(np.arange(len(months)), folds + 1)
+    return [(np.concatenate(blocks[:fold]), blocks[fold]) for fold in range(1, folds + 1) if len(blocks[fold])]
+
+
+def time_split_cv(df, y, factor_sets, model='ols', by='issue_d', folds=4, processes=None):
+    '''
+    Out of sample error of each set of factors, training on earlier issue months and testing
+    on later ones (see time_splits).
+
+    OLS folds come straight from the per month FactorGram, a fold's train and test sums are
+    sums of months. Logistic folds are fitted on a pool of forked processes.
+    :param model: 'ols' or 'logit'
+    returns: pandas.DataFrame, metrics per (model, fold); average with .groupby(level='model').mean()
+    '''
+    factor_sets = [list(factors) for factors in factor_sets]
+    labels = [_label(factors) for factors in factor_sets]
+    if model == 'ols':
+        gram = FactorGram(df, y, sorted(set(sum(factor_sets, []))), by=by)
+    elif model == 'logit':
+        gram, X, target = _logit_data(df, y, factor_sets, by)
+        order = np.argsort(gram.codes, kind='mergesort')
+        bounds = np.searchsorted(gram.codes[order], np.arange(len(gram.groups) + 1))
+    else:
+        raise ValueError('model must be ols or logit, not {}'.format(model))
+    splits = time_splits(gram.groups, folds)
+
+    rows, index = [], []
+    jobs, job_rows = [], []
+    for fold, (train, test) in enumerate(splits, 1):
+        train_matrix, test_matrix = gram.total(train), gram.total(test)
+        fold_info = {'train months': '{} - {}'.format(gram.groups[train[0]], gram.groups[train[-1]]),
+                     'test months': '{} - {}'.format(gram.groups[test[0]], gram.groups[test[-1]]),
+                     'train nobs': int(train_matrix[0, 0]), 'test nobs': int(test_matrix[0, 0])}
+        for size, (numbers, columns) in gram.subsets(factor_sets).items():
+            if model == 'ols':
+                beta, _, sse = ols_batch(train_matrix, columns)
+                test_sse = ols_error(test_matrix, columns, beta)
+                train_sst = train_matrix[-1, -1] - train_matrix[0, -1] ** 2 / train_matrix[0, 0]
+                test_sst = test_matrix[-1, -1] - test_matrix[0, -1] ** 2 / test_matrix[0, 0]
+                for model_number, number in enumerate(numbers):
+                    rows.append(dict(fold_info, **{'train r2': 1 - sse[model_number] / train_sst,
+                                                   'test r2': 1 - test_sse[model_number] / test_sst,
+                                                   'test rmse': np.sqrt(test_sse[model_number] / test_matrix[0, 0])}))
+                    index.append((labels[number], fold))
+            else:
+                starts = _logit_start(train_matrix, columns)
+                train_rows = order[bounds[train[0]]:bounds[train[-1] + 1]]
+                test_rows = order[bounds[test[0]]:bounds[test[-1] + 1]]
+                for model_number, number in enumerate(numbers):
+                    jobs.append((columns[model_number], starts[model_number], train_rows, test_rows))
+                    job_rows.append((fold_info, labels[number], fold))
+
+    if model == 'logit':
+        _shared.update(X=X, y=target)
+        try:
+            results = _run_jobs(_fit_logit_job, jobs, processes)
+        finally:
+            _shared.clear()
+        for (fold_info, label, fold), result in zip(job_rows, results):
+            rows.append(dict(fold_info, **{'train log loss': result['log loss'], 'train auc': result['auc'],
+                                           'test log loss': result['test log loss'], 'test auc': result['test auc'],
+                                           'test accuracy': result['test accuracy']}))
+            index.append((label, fold))
+
+    results = pd.DataFrame(rows, index=pd.MultiIndex.from_tuples(index, names=['model', 'fold']))
+    return results.sort_index()
+
+
+class OLSResult():
+    '''
+    A single OLS fit with the attributes the notebooks read from pd.ols: beta (factors then
+    intercept), std_err, t_stat, r2, r2_adj, nobs, resid and y_predict.
+    '''
+    def __init__(self, df, y, x):
+        x = [x] if isinstance(x, basestring) else list(x)
+        fit = fit_ols(df, y, [x])
+        label = _label(x)
+        coefficients = fit.coefficients.loc[label].reindex(x + ['intercept'])
+        self.beta = coefficients['beta']
+        self.std_err = coefficients['std err']
+        self.t_stat = coefficients['t stat']
+        self.r2 = fit.summary.loc[label, 'r2']
+        self.r2_adj = fit.summary.loc[label, 'adj r2']
+        self.nobs = fit.summary.loc[label, 'nobs']
+        rows = df[df[[y] + [column for column in x if column in df.columns]].notnull().all(axis=1).values]
+        self.y_predict = self.predict(rows)
+        self.resid = rows[y] - self.y_predict
+
+    def predict(self, df):
+        factors = list(self.beta.index[:-1])
+        return pd.Series(_design(df, factors).dot(self.beta.values[:-1]) + self.beta['intercept'], index=df.index)
+
+
+def ols(df, y, x):
+    return OLSResult(df, y, x)
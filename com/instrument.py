@@ -0,0 +1,171 @@
+import json
+import os
+import timeit
+
+import pandas as pd
+
+
+class Probe():
+    '''
+    Base class for custom probes added to an Instrument, override the events of interest.
+    '''
+    def on_month(self, month):
+        pass
+
+    def on_phase(self, name, month, start, seconds):
+        pass
+
+    def on_count(self, name, month, value):
+        pass
+
+
+class _Phase():
+    __slots__ = ['instrument', 'name', 'start']
+
+    def __init__(self, instrument, name):
+        self.instrument = instrument
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.instrument.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrument.record_phase(self.name, self.start, self.instrument.clock() - self.start)
+        return False
+
+
+class Instrument():
+    '''
+    Wall time per phase and counters, both per backtest month.
+
+    Backtest wraps its phases (payments, solver, loan batch, stats, ...) in ``phase`` and
+    reports loan counts through ``count``. Phases nest, a phase's time includes the phases
+    run inside it. Probes are told about every event as it happens.
+
+        instrument = Instrument()
+        Backtest(..., instrument=instrument).run()
+        instrument.summary()
+        instrument.to_chrome_trace('trace.json')  # open in chrome://tracing or Perfetto
+    '''
+    enabled = True
+
+    def __init__(self, probes=None, clock=timeit.default_timer):
+        self.probes = list(probes or [])
+        self.clock = clock
+        self.origin = clock()
+        self.month = None
+        self.phases = []
+        self.counts = []
+
+    def add_probe(self, probe):
+        self.probes.append(probe)
+
+    def start_month(self, month):
+        self.month = month
+        for probe in self.probes:
+            probe.on_month(month)
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record_phase(self, name, start, seconds):
+        self.phases.append((name, self.month, start, seconds))
+        for probe in self.probes:
+            probe.on_phase(name, self.month, start, seconds)
+
+    def count(self, name, value=1):
+        self.counts.append((name, self.month, self.clock(), value))
+        for probe in self.probes:
+            probe.on_count(name, self.month, value)
+
+    def phase_frame(self):
+        return pd.DataFrame(self.phases, columns=['phase', 'month', 'start', 'seconds'])
+
+    def summary(self):
+        '''
+        returns: pandas.DataFrame, calls and seconds (total, mean, max) per phase, slowest first
+        '''
+        phases = self.phase_frame()
+        summary = phases.groupby('phase')['seconds'].agg(['size', 'sum', 'mean', 'max'])
+        summary.columns = ['calls', 'seconds', 'mean', 'max']
+        return summary.sort_values('seconds', ascending=False)
+
+    def month_table(self):
+        '''
+        returns: pandas.DataFrame, one row per month with the seconds spent in each phase and the counters
+        '''
+        phases = self.phase_frame().dropna(subset=['month'])
+        table = phases.groupby(['month', 'phase'])['seconds'].sum().unstack()
+        counts = pd.DataFrame(self.counts, columns=['name', 'month', 'time', 'value']).dropna(subset=['month'])
+        if len(counts):
+            table = table.join(counts.groupby(['month', 'name'])['value'].sum().unstack(), how='outer')
+        table.columns.name = None
+        return table
+
+    def trace_events(self, pid=None):
+        '''
+        The phases as complete ("X") events and counters as counter ("C") events of the
+        Chrome trace event format, times in microseconds from the Instrument's creation.
+        '''
+        pid = os.getpid() if pid is None else pid
+        events = []
+        for name, month, start, seconds in self.phases:
+            events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': 0, 'ts': (start - self.origin) * 1e6,
+                           'dur': seconds * 1e6, 'args': {'month': str(month)}})
+        for name, month, time, value in self.counts:
+            events.append({'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': (time - self.origin) * 1e6,
+                           'args': {'value': value, 'month': str(month)}})
+        return events
+
+    def to_chrome_trace(self, filepath=None):
+        trace = {'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}
+        if filepath:
+            with open(filepath, 'w') as fp:
+                json.dump(trace, fp)
+        return trace
+
+    def to_json(self, filepath=None):
+        '''
+        The raw phases and counters, months as strings.
+        '''
+        records = {
+            'phases': [{'phase': name, 'month': str(month), 'start': start - self.origin, 'seconds': seconds}
+                       for name, month, start, seconds in self.phases],
+            'counts': [{'name': name, 'month': str(month), 'time': time - self.origin, 'value': value}
+                       for name, month, time, value in self.counts],
+        }
+        if filepath:
+            with open(filepath, 'w') as fp:
+                json.dump(records, fp, indent=2)
+        return records
+
+
+class _NullPhase():
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullInstrument():
+    '''
+    Instrument that records nothing, what a Backtest uses unless given one.
+    '''
+    enabled = False
+    _phase = _NullPhase()
+
+    def start_month(self, month):
+        pass
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, value=1):
+        pass
+
+
+null_instrument = NullInstrument()
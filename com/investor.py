@@ -1,17 +1,27 @@
-from loan import Loan
+from loan import batch_to_loans
+from portfolio import Portfolio, LoanCalendar, fold_sum
 
 class Investor():
     def __init__(self, balance=1000, loans=None):
-        self.loans = loans or list()
+        self.loans = list()
         self.balance = balance
         self.cum_imbalance = 0
         self.cum_defaults = 0
         self.abs_cum_imbalance = 0
-    
+        # loans added so far, each loan's position is its place among them
+        self.bought = 0
+        for loan in loans or []:
+            self.add_loan(loan)
+
     def get_net_worth(self):
         return self.balance + sum([loan.get_pv() for loan in self.loans])
-    
+
     def get_payments(self):
+        '''
+        returns: (purchase positions, imbalance ratios) of the loans that completed, a
+            loan's purchase position being its place in the order the loans were added
+        '''
+        completed = []
         for loan in self.loans:
             received = loan.make_payment()
             self.balance += received
@@ -19,19 +29,95 @@ class Investor():
                 self.cum_defaults += loan.defaults
                 self.cum_imbalance += loan.get_imbalance()
                 self.abs_cum_imbalance += loan.get_abs_imbalance()
-                self.remove_loan(loan)
-                
+                completed.append(loan)
+        # drop completed loans after the loop, removing while iterating skipped the next loan's payment
+        self.loans = [loan for loan in self.loans if not loan.complete]
+        return [loan.position for loan in completed], [loan.imbalance_ratio for loan in completed]
+
     def buy_loans(self, loans):
         for loan in loans:
             self.add_loan(loan)
             self.balance -= loan.investment
-        
+
+    def buy_batch(self, batch):
+        '''
+        Buys the loans of a loan_batch.
+        '''
+        self.buy_loans(batch_to_loans(batch))
+
     def add_loan(self, loan):
         if loan not in self.loans:
+            loan.position = self.bought
+            self.bought += 1
             self.loans.append(loan)
-            
-                
+
+
     def remove_loan(self, loan):
         if loan in self.loans:
             self.loans.remove(loan)
-             
\ No newline at end of file
+
+
+class PortfolioInvestor(Investor):
+    '''
+    Investor holding its loans in a columnar Portfolio.
+
+    Payments, completions, defaults and present value for the whole book are a few
+    array operations per month instead of a loop over Loan objects. Totals are
+    accumulated in purchase order, so stats match the list based Investor.
+    '''
+    def __init__(self, balance=1000, loans=None):
+        Investor.__init__(self, balance)
+        self.loans = Portfolio()
+        if loans:
+            self.loans.add_loans(loans)
+
+    def get_net_worth(self):
+        return self.balance + fold_sum(0, self.loans.get_pv())
+
+    def get_payments(self):
+        received, completed = self.loans.make_payments()
+        self.balance = fold_sum(self.balance, received)
+        self.cum_defaults = fold_sum(self.cum_defaults, self.loans.defaults[completed])
+        self.cum_imbalance = fold_sum(self.cum_imbalance, self.loans.get_imbalance(completed))
+        self.abs_cum_imbalance = fold_sum(self.abs_cum_imbalance, self.loans.get_abs_imbalance(completed))
+        return completed, self.loans.imbalance_ratio[completed]
+
+    def buy_loans(self, loans):
+        loans = list(loans)
+        self.loans.add_loans(loans)
+        self.balance = fold_sum(self.balance, [-loan.investment for loan in loans])
+
+    def buy_batch(self, batch):
+        self.loans.add_batch(batch)
+        self.balance = fold_sum(self.balance, -batch['investment'])
+
+    def add_loan(self, loan):
+        self.loans.add_loans([loan])
+
+    def remove_loan(self, loan):
+        self.loans.remove_loans([position for position in self.loans.active if self.loans.id[position] == loan.id])
+
+
+class ScheduledInvestor(PortfolioInvestor):
+    '''
+    Investor whose loans' cashflows are computed in full when they are bought.
+
+    Monthly payments and net worth are lookups into a LoanCalendar, see there for
+    how results can differ from the other investors.
+    '''
+    def __init__(self, balance=1000, loans=None, horizon=600):
+        Investor.__init__(self, balance)
+        self.loans = LoanCalendar(horizon=horizon)
+        if loans:
+            self.loans.add_loans(loans)
+
+    def get_net_worth(self):
+        return self.balance + self.loans.get_total_pv()
+
+    def get_payments(self):
+        cash, defaults, imbalance, abs_imbalance, completed = self.loans.advance()
+        self.balance += cash
+        self.cum_defaults += defaults
+        self.cum_imbalance += imbalance
+        self.abs_cum_imbalance += abs_imbalance
+        return completed, self.loans.imbalance_ratio[completed]
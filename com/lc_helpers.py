@@ -1,11 +1,20 @@
 import datetime
+import hashlib
+import json
+import multiprocessing
 import os
 import warnings
 
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
+
+from column_store import write_frame, read_frame
+from compact import compact_frame
+from partitioned import partition_frames, PartitionedSource
+from scores import ScoreCache
+from memo import ResultCache
+from fingerprint import FileFingerprints, code_fingerprint
+from fitting import ols
 
 
 states = ['state_MT', 'state_NE', 'state_NV', 'state_NH', 'state_NJ',
@@ -33,32 +42,161 @@ def get_db_folder():
     'testing2': '{}{}'.format(data_folder, 'LoanStats3c.csv'),
     'testing3': '{}{}'.format(data_folder, 'LoanStats3d.csv'),
     'complete': '{}{}'.format(data_folder, 'LoanStatsTotal.csv'),
-    'cache': '{}{}'.format(data_folder, 'loan_cache.hdf5')
+    'cache': '{}{}'.format(data_folder, 'loan_cache/'),
+    'partitioned': '{}{}'.format(data_folder, 'loan_months/'),
+    'scores': '{}{}'.format(data_folder, 'loan_scores/'),
+    'results': '{}{}'.format(data_folder, 'backtest_results/')
   }
   return db_dict
 
-def get_cache_historic(rewrite=False):
+historic_sources = ['training', 'testing', 'testing2', 'testing3']
+
+# raw LoanStats columns read by make_df_numeric
+factor_columns = ['id', 'member_id', 'loan_amnt', 'funded_amnt', 'term', 'int_rate', 'installment', 'grade',
+                  'emp_length', 'home_ownership', 'annual_inc', 'verification_status', 'issue_d', 'loan_status',
+                  'purpose', 'addr_state', 'dti', 'delinq_2yrs', 'earliest_cr_line', 'inq_last_6mths',
+                  'mths_since_last_delinq', 'mths_since_last_record', 'open_acc', 'pub_rec', 'revol_bal',
+                  'revol_util', 'total_acc', 'total_pymnt', 'total_rec_prncp', 'recoveries', 'last_pymnt_d',
+                  'mths_since_last_major_derog', 'application_type']
+
+# text columns, read as strings whatever a chunk happens to contain
+text_columns = ['term', 'int_rate', 'grade', 'emp_length', 'home_ownership', 'verification_status', 'issue_d',
+                'loan_status', 'purpose', 'addr_state', 'earliest_cr_line', 'revol_util', 'last_pymnt_d',
+                'application_type']
+
+# raw columns the historic cache keeps besides factor_columns
+extra_columns = []
+
+def read_loan_csv(filepath, columns=None, chunksize=50000):
+    '''
+    Reads a LoanStats CSV in chunks with the text columns typed up front.
+
+    :param columns: list, extra columns to keep besides the ones make_df_numeric needs,
+        all columns by default
+    '''
+    header = pd.read_csv(filepath, nrows=0).columns
+    usecols = None
+    if columns is not None:
+        wanted = set(columns) | set(factor_columns)
+        usecols = [column for column in header if column in wanted]
+    dtype = {column: object for column in text_columns if column in header}
+    return pd.concat(pd.read_csv(filepath, usecols=usecols, dtype=dtype, chunksize=chunksize))
+
+def build_source_cache(args):
+    source, filepath, source_dir = args
+    source_df = read_loan_csv(filepath, columns=extra_columns).pipe(make_df_numeric, fix_nans=True)
+    write_frame(source_df, source_dir, sort_by='issue_d')
+    return source
+
+def factor_fingerprint():
+    '''
+    Hash of everything on the ingest path from a LoanStats CSV to its cached frame.
+    '''
+    return code_fingerprint(read_loan_csv, build_source_cache, make_df_numeric, create_relevant_subset,
+                            create_factors, remove_nans, fix_issue_date, map_unique, parse_months,
+                            _strip_percent, _fix_emp_length, factor_columns, text_columns, extra_columns,
+                            states, purposes)
+
+def get_cache_historic(rewrite=False, columns=None, sdate=None, edate=None, processes=None, compact=False):
+    '''
+    The historic loans, cached per source file as memory mapped columns.
+
+    A source is rebuilt only when its CSV or the ingest code (see factor_fingerprint)
+    changed since it was cached, or when rewrite is set. Only factor_columns and
+    extra_columns of the CSVs are read and cached.
+    :param columns: list, columns to load, all by default
+    :param sdate, edate: first and last issue month to load, the whole history by default
+    :param processes: int, stale sources are rebuilt concurrently on this many processes
+    :param compact: bool or 'packed', return compact_frame(historic) (packed drops the dummy columns)
+    '''
+    source_dirs = update_historic_cache(rewrite, processes)
+    frames = [read_frame(source_dirs[source], columns=columns, sdate=sdate, edate=edate) for source in historic_sources]
+    historic_df = pd.concat(frames)
+    if compact:
+        return compact_frame(historic_df, pack_dummies=(compact == 'packed'))
+    return historic_df
+
+
+def update_historic_cache(rewrite=False, processes=None):
+    '''
+    Rebuilds the stale sources of the historic cache, see get_cache_historic.
+
+    returns: dict, source -> its cached frame's folder
+    '''
+    db = get_db_folder()
+    cache_dir = db['cache']
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    manifest = json.load(open(manifest_file)) if os.path.exists(manifest_file) else dict()
+    files = FileFingerprints(os.path.join(cache_dir, 'files.json'))
+    factors = factor_fingerprint()
+
+    fingerprints = {source: '{}-{}'.format(files.get(db[source]), factors) for source in historic_sources}
+    source_dirs = {source: os.path.join(cache_dir, source) for source in historic_sources}
+    stale = [source for source in historic_sources
+             if rewrite or manifest.get(source) != fingerprints[source] or not os.path.exists(source_dirs[source])]
+
+    if stale:
+        warnings.warn('Historic Cache is stale for {stale}, creating at {cache_dir}'.format(stale=', '.join(stale), cache_dir=cache_dir))
+        jobs = [(source, db[source], source_dirs[source]) for source in stale]
+        if len(jobs) == 1 or processes == 1:
+            for job in jobs:
+                build_source_cache(job)
+        else:
+            pool = multiprocessing.Pool(min(len(jobs), processes or multiprocessing.cpu_count()))
+            try:
+                pool.map(build_source_cache, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        for source in stale:
+            manifest[source] = fingerprints[source]
+        with open(manifest_file, 'w') as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+    return source_dirs
+
+
+def get_partitioned_historic(columns=None, rewrite=False, processes=None):
+    '''
+    The historic loans as a PartitionedSource, one partition per issue month, for backtests
+    that should not hold the whole history in memory.
+
+    The store is built from the historic cache a month at a time and rebuilt whenever a
+    cached source changed.
+    :param columns: list, columns the source loads, all by default
+    '''
+    source_dirs = update_historic_cache(rewrite, processes)
     db = get_db_folder()
-    cache_file = db['cache']
-    if os.path.exists(cache_file) and not rewrite:
-        return pd.read_hdf(cache_file, 'historic')
-    else:
-        warnings.warn('Historic Cache does not exist, creating at {cache_file}'.format(cache_file=cache_file))
-        training = pd.read_csv(db['training']).pipe(make_df_numeric, fix_nans=True)
-        testing = pd.read_csv(db['testing']).pipe(make_df_numeric, fix_nans=True)
-        testing2 = pd.read_csv(db['testing2']).pipe(make_df_numeric, fix_nans=True)
-        testing3 = pd.read_csv(db['testing3']).pipe(make_df_numeric, fix_nans=True)
-        historic_df = pd.concat([training, testing, testing2, testing3])
-        historic_df.to_hdf(cache_file, 'historic')
-        return historic_df
+    path = db['partitioned']
+    manifest = json.load(open(os.path.join(db['cache'], 'manifest.json')))
+    sources = {source: manifest[source] for source in historic_sources}
+    built_file = os.path.join(path, 'sources.json')
+    if rewrite or not os.path.exists(built_file) or json.load(open(built_file)) != sources:
+        warnings.warn('Partitioned historic store is stale, creating at {}'.format(path))
+        partition_frames([source_dirs[source] for source in historic_sources], path)
+        with open(built_file, 'w') as fp:
+            json.dump(sources, fp, indent=2, sort_keys=True)
+    # the sources' fingerprints already cover their CSVs and the factor code
+    data_key = hashlib.sha1(json.dumps([sources, sorted(columns) if columns is not None else None],
+                                       sort_keys=True)).hexdigest()
+    return PartitionedSource(path, columns=columns, data_key=data_key)
+
+
+def get_score_cache():
+    return ScoreCache(get_db_folder()['scores'])
+
+
+def get_result_cache(max_bytes=2 ** 30):
+    return ResultCache(get_db_folder()['results'], max_bytes)
 
 
 
 def df_ols(df, y, x):
-    for var in [x, y]:
-        if not hasattr(var, '__iter__'):
-            var = [var]
-    return pd.ols(y=df[y], x=df[x])
+    '''
+    OLS of y on x with an intercept, see fitting.OLSResult (pd.ols is gone from pandas).
+    '''
+    return ols(df, y, x)
 
 
 def make_df_numeric(df, edate='20170101', fix_nans=False):
@@ -76,12 +214,35 @@ def fix_issue_date(x):
         return None
 
 
+def map_unique(series, func, na_value=np.nan):
+    '''
+    series.map(func), calling func once per distinct value rather than once per row.
+    '''
+    codes, uniques = pd.factorize(series)
+    mapped = np.array([func(value) for value in uniques] + [na_value], dtype=object)
+    return pd.Series(mapped[codes], index=series.index)
+
+
+def parse_months(series):
+    return map_unique(series, fix_issue_date, na_value=fix_issue_date(np.nan))
+
+
+def _strip_percent(x):
+    return float(x.replace('%', '')) if isinstance(x, basestring) else np.nan
+
+
+def _fix_emp_length(x):
+    if not isinstance(x, basestring):
+        return np.nan
+    return x.replace('n/a', '0').replace('<', '0').replace('+', '').split(' ')[0]
+
+
 def create_relevant_subset(df, grades=['A','B','C','D','E','F','G'], edate='20130101'):
     df['loan_status'] = df['loan_status'].str.replace('Does not meet the credit policy. Status:', '')
     df = df.iloc[df['loan_status'].isin(['Fully Paid', 'Charged Off']).index, :].reset_index(drop=True)
     df = df[df['term'] == ' 36 months']
     df = df[df['grade'].isin(grades)]
-    df['issue_d'] = df['issue_d'].map(fix_issue_date).reindex()
+    df['issue_d'] = parse_months(df['issue_d'])
     df = df[df['issue_d'] < pd.Period(edate, freq='M')]
     return df
 
@@ -114,14 +275,14 @@ def create_factors(short_df, return_components=True):
             states_dummies[state] = 0 # if state not there, dummy=0 for all rows
     short_df = pd.concat([short_df, states_dummies], axis=1)
 
-    latest = short_df['earliest_cr_line'].map(fix_issue_date).reindex()
+    latest = parse_months(short_df['earliest_cr_line'])
     short_df['credit_history'] = np.maximum((short_df['issue_d'] - latest), 1)
 
-    short_df['last_pymnt_d'] = short_df['last_pymnt_d'].map(fix_issue_date).reindex()
+    short_df['last_pymnt_d'] = parse_months(short_df['last_pymnt_d'])
     short_df = short_df[~short_df['last_pymnt_d'].isnull()]
 
     import string
-    short_df['grade_int'] = short_df['grade'].apply(lambda x: string.lowercase.index(x.lower()))
+    short_df['grade_int'] = map_unique(short_df['grade'], lambda x: string.lowercase.index(x.lower())).astype(np.int64)
 
     short_df['annualized_profit'] = short_df['profit'] ** (1.0/(short_df['last_pymnt_d'] - short_df['issue_d']).astype(float)*12.0)
     short_df['annualized_ten_percent'] = short_df['annualized_profit']
@@ -129,15 +290,15 @@ def create_factors(short_df, return_components=True):
     short_df['dti'] = short_df['dti'] / 100
 
     for column in ['int_rate', 'revol_util']:
-        short_df[column] = short_df[column].str.replace('%', '').astype(float) / 100
+        short_df[column] = map_unique(short_df[column], _strip_percent).astype(float) / 100
 
-    short_df['emp_length'] = short_df['emp_length'].str.replace('n/a', '0').str.replace('<', '0').str.replace('+', '').str.split(' ').str[0]
+    short_df['emp_length'] = map_unique(short_df['emp_length'], _fix_emp_length)
 
-    for column in ['id', 'member_id', 'loan_amnt', 'dti', 'mths_since_last_delinq', 'mths_since_last_record', 'revol_bal',
+    float_columns = ['id', 'member_id', 'loan_amnt', 'dti', 'mths_since_last_delinq', 'mths_since_last_record', 'revol_bal',
                'revol_util', 'annual_inc', 'open_acc', 'total_acc', 'credit_history', 'emp_length', 'own_home',
                'pub_rec', 'installment', 'mths_since_last_major_derog', 'joint_account', 'recoveries', 'total_rec_prncp'
-               ,'total_pymnt']:
-        short_df[column] = short_df[column].astype(float)
+               ,'total_pymnt']
+    short_df[float_columns] = short_df[float_columns].astype(float)
 
     for column in ['loan_status']:
         short_df[column] = short_df[column].astype(str)
@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+
+from portfolio import pay_installment
+from month_index import month_ordinals
+
+
+class HoldingsLog():
+    '''
+    Append-only record of a backtest's buys, monthly payments and completions.
+
+    Nothing is stored per held loan per month. A month's holdings are the loans bought
+    up to that month and not yet completed, and their balances are replayed from the
+    state logged at purchase, since a held loan pays once every month.
+
+    Loans are matched to their completions by purchase position (see Investor.get_payments),
+    so a loan bought more than once completes once per purchase.
+    '''
+    # Loan attributes logged at purchase
+    loan_fields = ['id', 'grade', 'int_rate', 'term', 'initial_amount', 'amount', 'issue_date', 'last_date',
+                   'investment', 'defaults', 'total_payment', 'installment', 'remaining_term', 'scale', 'fee']
+
+    def __init__(self):
+        self.buy_batches = []
+        self.payments = []
+        self.completions = []
+        self.bought = 0
+        self._buys = None
+
+    def record_buys(self, month, batch):
+        '''
+        :param batch: dict, a loan_batch of the loans bought
+        '''
+        count = len(batch['id'])
+        if not count:
+            return
+        batch = {field: batch[field] for field in self.loan_fields}
+        batch['month'] = np.repeat(month.ordinal, count)
+        self.buy_batches.append(batch)
+        self.bought += count
+        self._buys = None
+
+    def record_payments(self, month, cash):
+        self.payments.append((month.ordinal, cash))
+
+    def record_completions(self, month, positions, imbalance_ratios):
+        '''
+        :param positions: the purchase positions of the loans that completed
+        '''
+        if len(positions):
+            self.completions.append((np.repeat(month.ordinal, len(positions)), np.asarray(positions, dtype=np.int64),
+                                     np.asarray(imbalance_ratios)))
+            self._buys = None
+
+    def buys(self):
+        '''
+        Every bought loan with its purchase month, completion month and imbalance ratio.
+
+        returns: dict of arrays, in purchase order
+        '''
+        if self._buys is not None:
+            return self._buys
+        buys = {field: np.concatenate([batch[field] for batch in self.buy_batches])
+                for field in self.loan_fields + ['month']} if self.buy_batches else \
+            {field: np.zeros(0) for field in self.loan_fields + ['month']}
+        buys['completes'] = np.empty(len(buys['id']), dtype=np.int64)
+        buys['completes'].fill(np.iinfo(np.int64).max)
+        buys['imbalance_ratio'] = np.empty(len(buys['id']))
+        buys['imbalance_ratio'].fill(np.nan)
+        if self.completions:
+            months, positions, ratios = [np.concatenate(parts) for parts in zip(*self.completions)]
+            buys['completes'][positions] = months
+            buys['imbalance_ratio'][positions] = ratios
+        buys['last_month'] = month_ordinals(buys['last_date'])
+        self._buys = buys
+        return buys
+
+    def completed_imbalance_ratios(self):
+        buys = self.buys()
+        return buys['imbalance_ratio'][~np.isnan(buys['imbalance_ratio'])]
+
+    def replay(self, positions, payments):
+        '''
+        State of loans after a number of monthly payments, one result per (position, payments)
+        pair. Each loan is stepped once up to the most payments asked of it.
+
+        returns: (amount, imbalance), unscaled like the Loan attributes
+        '''
+        buys = self.buys()
+        amount_out = np.zeros(len(positions))
+        imbalance_out = np.zeros(len(positions))
+        if not len(positions):
+            return amount_out, imbalance_out
+
+        loans, inverse = np.unique(positions, return_inverse=True)
+        needed = np.zeros(len(loans), dtype=np.int64)
+        np.maximum.at(needed, inverse, payments)
+        amount = buys['amount'][loans].astype(float)
+        imbalance = np.zeros(len(loans))
+
+        order = np.argsort(payments, kind='mergesort')
+        bounds = np.searchsorted(payments[order], np.arange(needed.max() + 2))
+        for step in range(needed.max() + 1):
+            rows = order[bounds[step]:bounds[step + 1]]
+            amount_out[rows] = amount[inverse[rows]]
+            imbalance_out[rows] = imbalance[inverse[rows]]
+            paying = np.nonzero(needed > step)[0]
+            if not len(paying):
+                break
+            rows = loans[paying]
+            amount[paying], received = pay_installment(amount[paying], buys['installment'][rows],
+                                                       buys['int_rate'][rows], buys['fee'][rows])
+            imbalance[paying] += received
+        return amount_out, imbalance_out
+
+    def holdings_table(self, first, last):
+        '''
+        Long-format holdings: one row per month from first to last and loan held at the end of it,
+        with the Loan.to_dict columns as of that month plus ``month`` and ``end_month`` (Period
+        ordinals) and ``position`` (the loan's place in that month's holdings, in purchase order).
+        imbalance_percentage is the loan's realized imbalance ratio, filled once it completes.
+        '''
+        buys = self.buys()
+        if not self.bought:
+            return pd.DataFrame()
+        start = np.maximum(buys['month'], first.ordinal)
+        stop = np.minimum(buys['completes'], last.ordinal + 1)
+        months_held = np.maximum(stop - start, 0)
+        positions = np.repeat(np.arange(len(months_held)), months_held)
+        offsets = np.arange(len(positions)) - np.repeat(np.cumsum(months_held) - months_held, months_held)
+        month = start[positions] + offsets
+
+        # group by month keeping purchase order within a month
+        order = np.lexsort((positions, month))
+        positions, month = positions[order], month[order]
+        payments = month - buys['month'][positions]
+        amount, imbalance = self.replay(positions, payments)
+
+        scale = buys['scale'][positions]
+        initial_amount = buys['initial_amount'][positions]
+        defaults = buys['defaults'][positions]
+        pv = np.where(defaults != 0, amount + initial_amount - buys['total_payment'][positions], amount) * scale
+        month_starts = np.searchsorted(month, month, side='left')
+        return pd.DataFrame({
+            'month': month,
+            'position': np.arange(len(month)) - month_starts,
+            'id': buys['id'][positions],
+            'grade': buys['grade'][positions],
+            'int_rate': buys['int_rate'][positions],
+            'amount': initial_amount,
+            'term': buys['term'][positions],
+            'remaining_amount': pv,
+            'issue_date': buys['issue_date'][positions],
+            'end_date': buys['last_date'][positions],
+            'end_month': buys['last_month'][positions],
+            'investment': buys['investment'][positions],
+            'defaulted': defaults,
+            'absolute_imbalance': np.abs(imbalance) * scale,
+            'installment': buys['installment'][positions] * scale,
+            'imbalance': imbalance * scale,
+            'completed': np.zeros(len(month), dtype=bool),
+            'imbalance_percentage': buys['imbalance_ratio'][positions],
+            'remaining_terms': buys['remaining_term'][positions] - payments,
+            'fee': buys['fee'][positions],
+        })
+
+    def holdings(self, month):
+        '''
+        The loans held at the end of month, see holdings_table.
+        '''
+        table = self.holdings_table(month, month)
+        if table.empty:
+            return pd.DataFrame()
+        return table.drop(['month', 'end_month', 'position'], axis=1)
@@ -1,6 +1,9 @@
 import numpy as np
+import pandas as pd
 
-class Loan():
+from month_index import month_ordinals
+
+class Loan(object):
     def __init__(self, loan_id, grade, int_rate, term, amount, issue_date, 
                  last_date, defaults, investment, total_payment, total_principle, recoveries):
         self.id = loan_id
@@ -89,4 +92,77 @@ class Loan():
             self.complete = True
 
 
+def loan_batch(df, investment):
+    '''
+    The Loan attributes of every row of df (rows of the historic db) as arrays, computed
+    in one vectorized step with the same rules as Loan.__init__.
+
+    :param investment: float, or an array of the investment in each row's loan
+    returns: dict, Loan attribute name -> numpy array
+    '''
+    count = len(df)
+    if not count:
+        return {field: np.zeros(0) for field in batch_fields}
+    codes, uniques = pd.factorize(df['term'])
+    terms = np.array([int(term.strip().split(' ')[0]) for term in uniques], dtype=np.int64)[codes]
+    issue_dates = np.asarray(df['issue_d'], dtype=object)
+    last_dates = np.asarray(df['last_pymnt_d'], dtype=object)
+    term_realized = month_ordinals(last_dates) - month_ordinals(issue_dates)
+
+    initial_amount = np.asarray(df['funded_amnt'], dtype=float)
+    defaults = np.asarray(df['defaulted'])
+    total_payment = np.asarray(df['total_pymnt'], dtype=float)
+    amount = np.where(defaults != 0, total_payment, initial_amount)
+    int_rate = np.asarray(df['int_rate'], dtype=float)
+    investment = np.repeat(float(investment), count) if np.ndim(investment) == 0 else np.asarray(investment, dtype=float)
+    imbalance_ratio = np.empty(count)
+    imbalance_ratio.fill(np.nan)
+
+    return {
+        'id': np.asarray(df['id']),
+        'grade': np.asarray(df['grade'], dtype=object),
+        'int_rate': int_rate,
+        'term': terms,
+        'amount': amount,
+        'initial_amount': initial_amount,
+        'issue_date': issue_dates,
+        'last_date': last_dates,
+        'investment': investment,
+        'defaults': defaults,
+        'total_payment': total_payment,
+        'total_principle': np.asarray(df['total_rec_prncp'], dtype=float),
+        'recoveries': np.asarray(df['recoveries'], dtype=float),
+        'imbalance_ratio': imbalance_ratio,
+        'term_realized': term_realized,
+        'installment': np.round(-np.pmt(int_rate / 12, term_realized, amount), 2),
+        'remaining_term': term_realized.copy(),
+        'scale': investment / initial_amount,
+        'imbalance': np.zeros(count),
+        'complete': np.zeros(count, dtype=bool),
+        'fee': np.repeat(0.01, count),
+    }
+
+# historic db columns loan_batch reads
+loan_columns = ['id', 'grade', 'int_rate', 'term', 'funded_amnt', 'issue_d', 'last_pymnt_d', 'defaulted',
+                'total_pymnt', 'total_rec_prncp', 'recoveries']
+
+batch_fields = ['id', 'grade', 'int_rate', 'term', 'amount', 'initial_amount', 'issue_date', 'last_date',
+                'investment', 'defaults', 'total_payment', 'total_principle', 'recoveries', 'imbalance_ratio',
+                'term_realized', 'installment', 'remaining_term', 'scale', 'imbalance', 'complete', 'fee']
+
+
+def batch_to_loans(batch):
+    '''
+    Loan objects for a loan_batch, for code that still works on Loan instances. The batch
+    already holds every Loan attribute, so they are assigned rather than computed again.
+    '''
+    loans = []
+    for values in zip(*[batch[field].tolist() for field in batch_fields]):
+        loan = Loan.__new__(Loan)
+        loan.__dict__.update(zip(batch_fields, values))
+        loans.append(loan)
+    return loans
+
 
+def loans_to_batch(loans):
+    return {field: np.array([getattr(loan, field) for loan in loans]) for field in batch_fields}
@@ -0,0 +1,191 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from multi import MultiBacktest
+
+
+def _group_starts(sorted_groups):
+    # position of the first entry of each entry's group, groups sorted
+    return np.searchsorted(sorted_groups, sorted_groups)
+
+
+def allocate(supply, loan, requested, rule='pro rata', priority=None, whole_notes=False, random=None):
+    '''
+    Splits each loan's notes among the bids on it.
+
+    :param supply: array, notes each loan offers
+    :param loan, requested: one entry per bid, the loan's position in supply and the notes asked for
+    :param rule: 'pro rata' fills every bid on an oversubscribed loan by the same fraction,
+        'priority' fills them in order of priority (lower first), ties at random
+    :param priority: array, one per bid, for the priority rule
+    :param whole_notes: bool, fill whole notes only: pro rata leftovers go to the largest
+        fractions, ties at random
+    returns: array, notes filled per bid
+    '''
+    random = random or np.random
+    loan = np.asarray(loan, dtype=np.int64)
+    requested = np.asarray(requested, dtype=float)
+    supply = np.floor(supply) if whole_notes else np.asarray(supply, dtype=float)
+    if not len(loan):
+        return np.zeros(0)
+
+    if rule == 'pro rata':
+        demand = np.bincount(loan, weights=requested, minlength=len(supply))
+        ratio = np.where(demand > supply, supply / np.where(demand > 0, demand, 1), 1.0)
+        share = requested * ratio[loan]
+        if not whole_notes:
+            return share
+        filled = np.floor(share)
+        left = supply - np.bincount(loan, weights=filled, minlength=len(supply))
+        remainder = share - filled
+        order = np.lexsort((random.rand(len(loan)), -remainder, loan))
+        sorted_loan = loan[order]
+        within = np.arange(len(order)) - _group_starts(sorted_loan)
+        extra = (within < left[sorted_loan]) & (remainder[order] > 0)
+        filled[order[extra]] += 1
+        return filled
+
+    if rule == 'priority':
+        if priority is None:
+            raise ValueError('the priority rule needs a priority per bid')
+        order = np.lexsort((random.rand(len(loan)), priority, loan))
+        sorted_loan = loan[order]
+        sorted_requested = requested[order]
+        # notes asked for by the bids ahead on the same loan
+        ahead = np.cumsum(sorted_requested) - sorted_requested
+        ahead -= ahead[_group_starts(sorted_loan)]
+        filled = np.empty(len(loan))
+        filled[order] = np.clip(supply[sorted_loan] - ahead, 0, sorted_requested)
+        return filled
+
+    raise ValueError('rule must be pro rata or priority, not {}'.format(rule))
+
+
+def match(supply, bidder, loan, requested, budget, rounds=1, priority=None, **kwargs):
+    '''
+    Fills bids over up to rounds rounds, see allocate.
+
+    Each bidder's bids are its choices in order of preference. A round takes every bidder's
+    next choices its remaining budget covers, and bidders left with budget move on to their
+    later choices in the next round, on the notes the earlier rounds left.
+
+    :param bidder, loan, requested: one entry per bid, each bidder's bids in order of preference
+    :param budget: array, notes each bidder can buy
+    :param priority: array, one per bidder, for the priority rule
+    returns: (filled, submitted), per bid the notes filled and whether it was placed in a round
+    '''
+    bidder = np.asarray(bidder, dtype=np.int64)
+    loan = np.asarray(loan, dtype=np.int64)
+    requested = np.asarray(requested, dtype=float)
+    supply = np.asarray(supply, dtype=float).copy()
+    budget = np.asarray(budget, dtype=float).copy()
+    filled = np.zeros(len(loan))
+    tried = np.zeros(len(loan), dtype=bool)
+    submitted = np.zeros(len(loan), dtype=bool)
+    # stable, bids stay in preference order within a bidder
+    order = np.argsort(bidder, kind='mergesort')
+
+    for _ in range(rounds):
+        tried |= supply[loan] <= 1e-9
+        waiting = order[~tried[order]]
+        if not len(waiting):
+            break
+        waiting_bidder = bidder[waiting]
+        waiting_requested = requested[waiting]
+        before = np.cumsum(waiting_requested) - waiting_requested
+        before -= before[_group_starts(waiting_bidder)]
+        bids = waiting[before + waiting_requested <= budget[waiting_bidder] + 1e-9]
+        if not len(bids):
+            break
+        got = allocate(supply, loan[bids], requested[bids],
+                       priority=None if priority is None else np.asarray(priority)[bidder[bids]], **kwargs)
+        filled[bids] = got
+        tried[bids] = True
+        submitted[bids] = True
+        supply -= np.bincount(loan[bids], weights=got, minlength=len(supply))
+        budget -= np.bincount(bidder[bids], weights=got, minlength=len(budget))
+    return filled, submitted
+
+
+class MarketBacktest(MultiBacktest):
+    '''
+    Strategies competing for the same loans, instead of each buying as if it were the only
+    investor.
+
+    Every month each strategy's solver picks its loans from the shared month_db as in
+    MultiBacktest, then each loan's notes (funded_amnt / note_size, less the share taken by
+    investors outside the backtest) are split among the strategies that picked it, see
+    allocate. A strategy pays for the part of its buy_size it was filled, so a partly filled
+    note is a smaller investment in the loan.
+
+        market = MarketBacktest('2009-01', '2015-12', db, strategies, cash=10000,
+                                outside_share=0.95, rounds=3, overbid=2)
+        stats = market.run()
+        market.market_stats['fill rate']
+
+    :param note_size: float, dollars per note
+    :param rule: 'pro rata' or 'priority', see allocate
+    :param priority: dict, strategy name -> priority (lower first) for the priority rule
+    :param outside_share: float, share of every loan bought by investors outside the backtest
+    :param rounds: int, rounds of bids a month, see match
+    :param overbid: float, solvers pick up to overbid times the loans their cash buys, the
+        extra picks being the later choices bid on in later rounds
+    :param whole_notes: bool, only fill whole notes
+    :param seed: int, seeds the tie breaks
+    '''
+    def __init__(self, sdate, edate, db, strategies, month_index=None, note_size=25.0, rule='pro rata', priority=None,
+                 outside_share=0.0, rounds=1, overbid=1.0, whole_notes=False, seed=None, **settings):
+        MultiBacktest.__init__(self, sdate, edate, db, strategies, month_index, **settings)
+        self.note_size = note_size
+        self.rule = rule
+        self.priority = priority
+        self.outside_share = outside_share
+        self.rounds = rounds
+        self.overbid = overbid
+        self.whole_notes = whole_notes
+        self.random = np.random.RandomState(seed)
+        self.market = OrderedDict()
+
+    def solve_month(self, record=True):
+        month_db = self.month_slice()
+        backtests = list(self.backtests.values())
+        completed = [bt.receive_payments(record) for bt in backtests]
+
+        budgets = np.array([np.floor(bt.investor.balance / bt.buy_size) for bt in backtests])
+        choices = [bt.choose(month_db, int(np.floor(number * self.overbid))) for bt, number in zip(backtests, budgets)]
+        counts = np.array([len(choice['loans']) for choice in choices], dtype=np.int64)
+        bid_size = np.array([bt.buy_size for bt in backtests]) / self.note_size
+        bidder = np.repeat(np.arange(len(backtests)), counts)
+        ids = pd.Index(month_db['id'].values)
+        loan = np.concatenate([ids.get_indexer(choice['loans']['id'].values) for choice in choices] +
+                              [np.zeros(0, dtype=np.int64)])
+        supply = np.asarray(month_db['funded_amnt'], dtype=float) * (1 - self.outside_share) / self.note_size
+        priority = None if self.priority is None else [self.priority[name] for name in self.backtests]
+        filled, submitted = match(supply, bidder, loan, bid_size[bidder], budgets * bid_size, self.rounds, priority,
+                       rule=self.rule, whole_notes=self.whole_notes, random=self.random)
+
+        rows = OrderedDict()
+        stops = np.cumsum(counts)
+        for number, (name, bt) in enumerate(self.backtests.items()):
+            fraction = filled[stops[number] - counts[number]:stops[number]] / bid_size[number]
+            bought = fraction > 0
+            new_loans = bt.take(choices[number]['loans'][bought], bt.buy_size * fraction[bought])
+            rows[name] = bt.close_month(new_loans, choices[number]['matching quantity'],
+                                        choices[number]['available quantity'], record, len(completed[number]))
+            bt.month += 1
+        if record:
+            self.market[self.month] = {'notes offered': supply.sum(), 'notes requested': (bid_size * budgets).sum(),
+                                       'notes bid': bid_size[bidder[submitted]].sum(), 'notes filled': filled.sum(),
+                                       'loans bid': len(np.unique(loan[submitted])),
+                                       'bidders filled': len(np.unique(bidder[filled > 0]))}
+        self.month += 1
+        return rows
+
+    def run(self):
+        stats = MultiBacktest.run(self)
+        self.market_stats = pd.DataFrame.from_dict(self.market, orient='index')[
+            ['notes offered', 'notes requested', 'notes bid', 'notes filled', 'loans bid', 'bidders filled']]
+        self.market_stats['fill rate'] = self.market_stats['notes filled'] / self.market_stats['notes bid'].replace(0, np.nan)
+        return stats
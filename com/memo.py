@@ -0,0 +1,157 @@
+import hashlib
+import inspect
+import os
+import pickle
+
+import pandas as pd
+
+import backtest
+import compact
+import investor
+import ledger
+import loan
+import month_index
+import portfolio
+import solvers
+from backtest import Backtest
+from fingerprint import code_fingerprint, frame_fingerprint
+from scores import model_fingerprint
+
+# the Backtest attributes a ResultCache keeps
+result_attributes = ['stats', 'stats_dict', 'loan_stats', 'loan_stats_total', 'buy_solver_name']
+
+class BacktestResult():
+    '''
+    The results of a finished Backtest (see result_attributes), enough for a Report.
+    '''
+    def __init__(self, **results):
+        self.__dict__.update(results)
+
+
+class ResultCache():
+    '''
+    Results of finished backtests saved on disk under a hash of everything they follow from:
+    the db's contents, the solver (its code, and its settings for a RankedSolver), the
+    Backtest arguments and the code of the modules below. Editing any of those modules
+    changes every key, so stale results are never returned.
+
+    A db loaded by get_partitioned_historic carries a data_key derived from the cached sources
+    it was built from. A DataFrame is hashed on every lookup, so edits to it in place change
+    the key, but only the columns the backtest reads: loan_columns and, for a RankedSolver,
+    its columns (every column for other solvers).
+
+        cache = ResultCache('data/backtest_results/')
+        result = cache.run('2009-01', '2015-12', simple_filter_buy_solver, db, cash=1000)
+        Report(result).save('report.html')
+
+    Entries are pickles of result_attributes. Reading one touches its file, and once the
+    folder is over max_bytes the least recently used entries are removed.
+    :param max_bytes: int, size the folder is kept under
+    '''
+    modules = [loan, investor, portfolio, ledger, backtest, solvers, month_index, compact]
+    # Backtest arguments that do not change the results
+    ignored = ['month_index', 'instrument']
+
+    def __init__(self, path, max_bytes=2 ** 30):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def key(self, sdate, edate, buy_solver, db, data_key=None, **settings):
+        '''
+        :param data_key: str, fingerprint of db when already known, needed when db is neither a
+            DataFrame nor a source with a data_key
+        '''
+        if data_key is None:
+            if isinstance(db, pd.DataFrame):
+                data_key = frame_fingerprint(db, self.columns(buy_solver, db, settings.get('dummies')))
+            elif getattr(db, 'data_key', None) is not None:
+                data_key = db.data_key
+            else:
+                raise TypeError('pass data_key to key results on a {}'.format(type(db).__name__))
+        args, _, _, defaults = inspect.getargspec(Backtest.__init__.im_func)
+        arguments = dict(zip(args[-len(defaults):], defaults))
+        arguments.update(settings)
+        for name in self.ignored:
+            arguments.pop(name, None)
+        arguments['investor_class'] = arguments['investor_class'].__name__
+        arguments['sdate'] = str(pd.Period(sdate, freq='M'))
+        arguments['edate'] = str(pd.Period(edate, freq='M'))
+
+        sha = hashlib.sha1()
+        sha.update(data_key)
+        sha.update(model_fingerprint(buy_solver))
+        sha.update(code_fingerprint(*self.modules))
+        sha.update(repr(sorted(arguments.items())))
+        return sha.hexdigest()
+
+    def columns(self, buy_solver, db, dummies=None):
+        '''
+        The columns of db a Backtest with buy_solver reads, None (all) for solvers that do not
+        declare theirs.
+        '''
+        if not hasattr(buy_solver, 'columns'):
+            return None
+        columns = set(loan.loan_columns) | set(buy_solver.columns())
+        for name in dummies or []:
+            columns.update(source for prefix, source in compact.dummy_sources.items() if name.startswith(prefix))
+        return sorted(column for column in columns if column in db.columns)
+
+    def filepath(self, key):
+        return os.path.join(self.path, '{}.pkl'.format(key))
+
+    def get(self, key):
+        '''
+        returns: BacktestResult, None when key is not cached
+        '''
+        filepath = self.filepath(key)
+        try:
+            with open(filepath, 'rb') as fp:
+                results = pickle.load(fp)
+        except IOError:
+            return None
+        os.utime(filepath, None)
+        return BacktestResult(**results)
+
+    def put(self, key, bt):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        filepath = self.filepath(key)
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump({attribute: getattr(bt, attribute) for attribute in result_attributes}, fp,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, filepath)
+        self.evict(keep=filepath)
+
+    def evict(self, keep=None):
+        '''
+        Removes the least recently used entries until the folder is under max_bytes.
+        '''
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.pkl'):
+                filepath = os.path.join(self.path, name)
+                stat = os.stat(filepath)
+                entries.append((stat.st_mtime, stat.st_size, filepath))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filepath in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if filepath != keep:
+                os.remove(filepath)
+                total -= size
+
+    def run(self, sdate, edate, buy_solver, db, data_key=None, **settings):
+        '''
+        The results of Backtest(sdate, edate, buy_solver, db, **settings).run(), from the cache
+        when they are there.
+        returns: BacktestResult
+        '''
+        key = self.key(sdate, edate, buy_solver, db, data_key, **settings)
+        result = self.get(key)
+        if result is None:
+            bt = Backtest(sdate, edate, buy_solver, db, **settings)
+            bt.run()
+            self.put(key, bt)
+            result = BacktestResult(**{attribute: getattr(bt, attribute) for attribute in result_attributes})
+        return result
@@ -0,0 +1,87 @@
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+def month_ordinals(months):
+    return np.array([month.ordinal for month in months], dtype=np.int64)
+
+
+class MonthIndex():
+    '''
+    The row range of every issue month of the historic db.
+
+    A month's loans are then a positional slice of ``db`` instead of a boolean
+    scan of the whole table. Rows keep their original order within a month.
+    When db is not in month order, ``order`` holds the positions of its rows in
+    month order and months are gathered through it, so db itself is never copied
+    and edits to its values show up in every later month.
+    '''
+    def __init__(self, db, column='issue_d'):
+        ordinals = month_ordinals(db[column])
+        self.order = None
+        if len(ordinals) and (np.diff(ordinals) < 0).any():
+            self.order = np.argsort(ordinals, kind='mergesort')
+            ordinals = ordinals[self.order]
+        self.db = db
+        # db.index is replaced when rows are added, dropped or sorted in place
+        self.index = db.index
+        self.column = column
+        months, starts = np.unique(ordinals, return_index=True)
+        stops = np.append(starts[1:], len(ordinals))
+        self.bounds = dict(zip(months, zip(starts, stops)))
+
+    def get_bounds(self, month):
+        '''
+        returns: (start, stop) of month in month order, see in_month_order
+        '''
+        return self.bounds.get(month.ordinal, (0, 0))
+
+    def get(self, month):
+        start, stop = self.get_bounds(month)
+        if self.order is None:
+            return self.db.iloc[start:stop]
+        return self.db.iloc[self.order[start:stop]]
+
+    def positions(self, start, stop):
+        '''
+        The db row positions of the loans from start to stop in month order.
+        '''
+        return np.arange(start, stop) if self.order is None else self.order[start:stop]
+
+    def in_month_order(self, values):
+        '''
+        values, one per db row, in month order, so get_bounds slices them.
+        '''
+        return values if self.order is None else values[self.order]
+
+    def is_current(self, db):
+        return db.index is self.index
+
+    def months(self):
+        return [pd.Period(ordinal=ordinal, freq='M') for ordinal in sorted(self.bounds)]
+
+
+_month_indexes = dict()
+
+def _forget(ref, key):
+    if _month_indexes.get(key) is ref:
+        del _month_indexes[key]
+
+
+def get_month_index(db, column='issue_d'):
+    '''
+    The MonthIndex of ``db``, built on first use and shared by every Backtest over the
+    same DataFrame object while any of them holds it (the index holds db, so it is kept
+    weakly here), and rebuilt when db's rows change (edits to the values of existing rows
+    need no rebuild, except to the issue months themselves).
+    '''
+    key = (id(db), column)
+    ref = _month_indexes.get(key)
+    index = ref() if ref is not None else None
+    if index is not None and index.db is db and index.is_current(db):
+        return index
+    index = MonthIndex(db, column)
+    _month_indexes[key] = weakref.ref(index, lambda ref, key=key: _forget(ref, key))
+    return index
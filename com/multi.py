@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+import pandas as pd
+
+from backtest import Backtest
+from compact import with_dummies
+from month_index import get_month_index
+
+
+class MultiBacktest():
+    '''
+    Several strategies backtested together over one pass of the months.
+
+    Each strategy keeps its own Backtest (investor, holdings log and stats), and all of them
+    advance in lockstep: every month is sliced from db once and handed to each strategy's
+    solver, and declarative solvers share their precomputation over the one MonthIndex.
+    Every strategy's stats match a Backtest of it on its own.
+
+        multi = MultiBacktest('2009-01', '2015-12', db, OrderedDict([
+            ('simple filter', simple_filter_buy_solver),
+            ('single', single_buy_solver),
+            ('zero', zero_buy_solver),
+            ('simple filter, PortfolioInvestor', {'buy_solver': simple_filter_solver,
+                                                  'investor_class': PortfolioInvestor}),
+        ]), cash=1000)
+        stats = multi.run()
+        stats['single']['net worth']
+
+    :param strategies: dict (OrderedDict to keep an order) or list of (name, strategy) pairs, a
+        strategy being a buy solver or a dict of Backtest arguments including buy_solver
+    :param settings: Backtest arguments shared by every strategy (cash, buy_size, ...)
+    '''
+    def __init__(self, sdate, edate, db, strategies, month_index=None, **settings):
+        self.month = pd.Period(sdate, freq='M')
+        self.end_month = pd.Period(edate, freq='M')
+        self.db = db
+        if month_index is None:
+            month_index = get_month_index(db) if isinstance(db, pd.DataFrame) else db
+        self.month_index = month_index
+        self.settings = settings
+        self.backtests = OrderedDict()
+        for name, strategy in (strategies.items() if hasattr(strategies, 'items') else strategies):
+            if isinstance(strategy, dict):
+                self.add(name, **strategy)
+            else:
+                self.add(name, strategy)
+
+    def add(self, name, buy_solver, **settings):
+        '''
+        Adds a strategy, before the run starts.
+        :param settings: Backtest arguments overriding the shared ones
+        '''
+        if name in self.backtests:
+            raise ValueError('strategy {} is already in the backtest'.format(name))
+        arguments = dict(self.settings, **settings)
+        self.backtests[name] = Backtest(self.month, self.end_month, buy_solver, self.db,
+                                        month_index=self.month_index, **arguments)
+        return self.backtests[name]
+
+    def month_slice(self):
+        '''
+        The current month's loans, with the dummies any strategy reads.
+        '''
+        month_db = self.month_index.get(self.month)
+        dummies = []
+        for bt in self.backtests.values():
+            dummies.extend(column for column in bt.dummies or [] if column not in dummies)
+        if dummies:
+            month_db = with_dummies(month_db, dummies)
+        return month_db
+
+    def solve_month(self, record=True):
+        '''
+        returns: OrderedDict, each strategy's stats of the month
+        '''
+        month_db = self.month_slice()
+        rows = OrderedDict((name, bt.solve_month(record, month_db)) for name, bt in self.backtests.items())
+        self.month += 1
+        return rows
+
+    def run(self):
+        '''
+        returns: OrderedDict, each strategy's stats frame, as Backtest.run
+        '''
+        while self.month <= self.end_month:
+            print self.month, self.end_month
+            self.solve_month()
+        self.stats = OrderedDict((name, bt.finish()) for name, bt in self.backtests.items())
+        return self.stats
+
+    def summary(self):
+        '''
+        returns: pandas.DataFrame, one row per strategy with its final net worth, growth of $1,
+            default rate and sharpe
+        '''
+        rows = OrderedDict()
+        for name, bt in self.backtests.items():
+            last = bt.stats.iloc[-1]
+            rows[name] = {'net worth': last['net worth'], 'growth of $1': last['growth of $1'],
+                          'default rate': bt.stats['default rate'].mean(), 'sharpe': bt.stats_dict['sharpe']}
+        return pd.DataFrame(rows, index=['net worth', 'growth of $1', 'default rate', 'sharpe']).T
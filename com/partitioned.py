@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from column_store import write_frame, read_frame, read_meta, _load
+from month_index import month_ordinals
+
+
+def _month_dir(path, ordinal):
+    return os.path.join(path, pd.Period(ordinal=ordinal, freq='M').strftime('%Y-%m'))
+
+
+def _write_store(path, partitions, columns):
+    '''
+    Writes the store from (month ordinal, frame) pairs, generated one month at a time.
+    '''
+    tmp_path = path.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    rows = dict()
+    for ordinal, df in partitions:
+        write_frame(df, _month_dir(tmp_path, ordinal))
+        rows[str(ordinal)] = len(df)
+    with open(os.path.join(tmp_path, 'months.json'), 'w') as fp:
+        json.dump({'columns': columns, 'rows': rows}, fp, indent=2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def write_partitioned(df, path, column='issue_d'):
+    '''
+    Writes df as a store of one column store frame (see column_store) per issue month.
+    '''
+    ordinals = month_ordinals(df[column])
+    order = np.argsort(ordinals, kind='mergesort')
+    months, starts = np.unique(ordinals[order], return_index=True)
+    stops = np.append(starts[1:], len(order))
+    partitions = ((month, df.iloc[order[start:stop]]) for month, start, stop in zip(months, starts, stops))
+    _write_store(path, partitions, [str(name) for name in df.columns])
+
+
+def partition_frames(frame_paths, path):
+    '''
+    Writes a partitioned store from column store frames written with sort_by (the historic
+    cache's sources), reading one month of them at a time.
+    '''
+    metas = [read_meta(frame_path) for frame_path in frame_paths]
+    # the columns concatenating the frames gives
+    columns = [str(name) for name in pd.concat([pd.DataFrame(columns=[entry['name'] for entry in meta['columns']])
+                                                for meta in metas]).columns]
+    months = set()
+    for frame_path, meta in zip(frame_paths, metas):
+        sort_entry = [entry for entry in meta['columns'] if entry['name'] == meta['sort_by']][0]
+        months.update(np.unique(_load(os.path.join(frame_path, sort_entry['file']), 'r')))
+    months = [month for month in sorted(months) if month != np.iinfo(np.int64).min]
+
+    def partitions():
+        for ordinal in months:
+            month = pd.Period(ordinal=ordinal, freq='M')
+            frames = [read_frame(frame_path, sdate=month, edate=month) for frame_path in frame_paths]
+            yield ordinal, pd.concat([frame for frame in frames if len(frame)])
+    _write_store(path, partitions(), columns)
+
+
+class PartitionedSource():
+    '''
+    Historic loans read a month at a time from a store written by write_partitioned.
+
+    A drop-in for the in-memory MonthIndex as a Backtest's db: ``get(month)`` memory maps
+    that month's partition and loads only the chosen columns, so resident memory stays at
+    about one month of loans however long the history.
+
+        source = PartitionedSource('data/loan_months/', columns=loan_columns + solver.columns())
+        Backtest('2009-01', '2015-12', solver, source).run()
+
+    :param columns: list, columns to load, all by default. Months are reindexed to the store's
+        columns, those a month lacks come back as NaN
+    :param data_key: str, fingerprint of the data loaded, e.g. to key a ResultCache
+    '''
+    def __init__(self, path, columns=None, data_key=None):
+        self.path = path
+        self.data_key = data_key
+        with open(os.path.join(path, 'months.json')) as fp:
+            store = json.load(fp)
+        self.store_columns = [str(name) for name in store['columns']]
+        self.rows = {int(ordinal): count for ordinal, count in store['rows'].items()}
+        self.columns = self.store_columns if columns is None else \
+            [name for name in self.store_columns if name in set(columns)]
+
+    def __len__(self):
+        return sum(self.rows.values())
+
+    def months(self):
+        return [pd.Period(ordinal=ordinal, freq='M') for ordinal in sorted(self.rows)]
+
+    def get(self, month):
+        month = pd.Period(month, freq='M')
+        if month.ordinal not in self.rows:
+            return pd.DataFrame(columns=self.columns)
+        df = read_frame(_month_dir(self.path, month.ordinal), columns=self.columns)
+        if len(df.columns) < len(self.columns):
+            df = df.reindex(columns=self.columns)
+        return df
+
+    def get_frame(self, sdate=None, edate=None):
+        '''
+        The months from sdate to edate (inclusive) as one DataFrame.
+        '''
+        months = [month for month in self.months()
+                  if (sdate is None or month >= pd.Period(sdate, freq='M'))
+                  and (edate is None or month <= pd.Period(edate, freq='M'))]
+        frames = [self.get(month) for month in months]
+        return pd.concat(frames) if frames else pd.DataFrame(columns=self.columns)
@@ -0,0 +1,263 @@
+import numpy as np
+
+from loan import loans_to_batch
+from month_index import month_ordinals
+
+
+def fold_sum(start, values):
+    # left-to-right running sum, so totals match adding loans one at a time
+    if not len(values):
+        return start
+    return np.cumsum(np.concatenate([[start], values]))[-1]
+
+
+def pay_installment(amount, installment, int_rate, fee):
+    '''
+    Loan.make_payment on arrays: returns (remaining amount, payment received before scaling).
+    '''
+    payment_made = np.minimum(installment, amount)
+    payment_interest = int_rate / 12 * amount
+    payment_principal = payment_made - payment_interest
+    return amount - payment_principal, payment_made * (1.0 - fee)
+
+
+class Portfolio():
+    '''
+    Columnar book of loans following the same payment rules as Loan.
+
+    Every loan ever added keeps its row; ``active`` holds the row positions of
+    the loans currently held, in purchase order.
+    '''
+    float_fields = ['int_rate', 'initial_amount', 'amount', 'investment', 'total_payment',
+                    'installment', 'scale', 'imbalance', 'imbalance_ratio', 'fee']
+    int_fields = ['term', 'remaining_term', 'defaults']
+    object_fields = ['id', 'grade', 'issue_date', 'last_date']
+    # per-row bookkeeping of subclasses, not read from Loan
+    extra_fields = []
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.capacity = capacity
+        for field in self.float_fields:
+            setattr(self, field, np.zeros(capacity, dtype=float))
+        for field in self.int_fields:
+            setattr(self, field, np.zeros(capacity, dtype=np.int64))
+        for field in self.object_fields:
+            setattr(self, field, np.empty(capacity, dtype=object))
+        for field in self.extra_fields:
+            setattr(self, field, np.zeros(capacity, dtype=np.int64))
+        self.complete = np.zeros(capacity, dtype=bool)
+        self.active = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.active)
+
+    def __getstate__(self):
+        # pickle the rows in use, not the spare capacity
+        state = self.__dict__.copy()
+        for field in self.float_fields + self.int_fields + self.object_fields + self.extra_fields + ['complete']:
+            state[field] = state[field][:self.size]
+        state['capacity'] = self.size
+        return state
+
+    def reserve(self, count):
+        if self.size + count <= self.capacity:
+            return
+        capacity = max(self.capacity * 2, self.size + count)
+        for field in self.float_fields + self.int_fields + self.object_fields + self.extra_fields + ['complete']:
+            old = getattr(self, field)
+            new = np.zeros(capacity, dtype=old.dtype) if old.dtype != object else np.empty(capacity, dtype=object)
+            new[:self.size] = old[:self.size]
+            setattr(self, field, new)
+        self.capacity = capacity
+
+    def add_loans(self, loans):
+        return self.add_batch(loans_to_batch(list(loans)))
+
+    def add_batch(self, batch):
+        '''
+        Adds the loans of a loan_batch.
+
+        returns: their row positions
+        '''
+        count = len(batch['id'])
+        if not count:
+            return np.zeros(0, dtype=np.int64)
+        self.reserve(count)
+        rows = slice(self.size, self.size + count)
+        for field in self.float_fields + self.int_fields + self.object_fields + ['complete']:
+            getattr(self, field)[rows] = batch[field]
+        positions = np.arange(self.size, self.size + count)
+        self.size += count
+        self.active = np.concatenate([self.active, positions])
+        return positions
+
+    def make_payments(self):
+        '''
+        One month of Loan.make_payment for every held loan.
+
+        returns: (received, completed) where received is the scaled cash from each
+        held loan in purchase order and completed the row positions that finished
+        '''
+        idx = self.active
+        fee = self.fee[idx]
+        self.amount[idx], payment_received = pay_installment(self.amount[idx], self.installment[idx], self.int_rate[idx], fee)
+        remaining_term = self.remaining_term[idx] - 1
+        self.remaining_term[idx] = remaining_term
+
+        imbalance = self.imbalance[idx] + payment_received
+
+        done = remaining_term == 0
+        completed = idx[done]
+        total_payment = self.total_payment[completed]
+        imbalance[done] -= total_payment * (1.0 - fee[done])
+        self.imbalance[idx] = imbalance
+        self.imbalance_ratio[completed] = imbalance[done] / total_payment
+        self.complete[completed] = True
+
+        self.active = idx[~done]
+        return payment_received * self.scale[idx], completed
+
+    def remove_loans(self, positions):
+        self.active = self.active[~np.in1d(self.active, positions)]
+
+    def get_pv(self, positions=None):
+        idx = self.active if positions is None else positions
+        scale = self.scale[idx]
+        amount = self.amount[idx]
+        defaulted_pv = (amount + self.initial_amount[idx] - self.total_payment[idx]) * scale
+        return np.where(self.defaults[idx] != 0, defaulted_pv, amount * scale)
+
+    def get_imbalance(self, positions):
+        return self.imbalance[positions] * self.scale[positions]
+
+    def get_abs_imbalance(self, positions):
+        return np.abs(self.imbalance[positions]) * self.scale[positions]
+
+
+class LoanCalendar(Portfolio):
+    '''
+    Portfolio that runs every loan to completion when it is bought.
+
+    A loan's whole path is fixed at purchase (installment, realized term, default), so
+    its payments, present value and completion are computed up front and added to a
+    calendar indexed by payment round. Each round is then a lookup, and the cost
+    scales with the number of purchases rather than holdings times months.
+
+    Calendar totals add loans in purchase order within a round, but they are added to
+    the balance per round rather than per loan, so results can differ from
+    PortfolioInvestor in the last bits.
+    '''
+    extra_fields = ['bought', 'completes']
+    calendar_fields = ['cash', 'pv', 'defaults_due', 'imbalance_due', 'abs_imbalance_due']
+    never = np.iinfo(np.int64).max
+
+    def __init__(self, capacity=1024, horizon=600):
+        Portfolio.__init__(self, capacity)
+        self.horizon = horizon
+        self.round = 0
+        for field in self.calendar_fields:
+            setattr(self, field, np.zeros(horizon + 1, dtype=np.int64 if field == 'defaults_due' else float))
+
+    def reserve_rounds(self, rounds):
+        length = len(self.cash)
+        if rounds < length:
+            return
+        for field in self.calendar_fields:
+            old = getattr(self, field)
+            setattr(self, field, np.append(old, np.zeros(max(length, rounds + 1 - length), dtype=old.dtype)))
+
+    def add_batch(self, batch):
+        positions = Portfolio.add_batch(self, batch)
+        if len(positions):
+            self.schedule(positions)
+        return positions
+
+    def schedule(self, positions):
+        bought = self.round
+        self.bought[positions] = bought
+        self.simulate(positions, self.amount[positions].copy(), self.remaining_term[positions].copy(),
+                      self.imbalance[positions].copy(), bought)
+
+    def simulate(self, positions, amount, remaining_term, imbalance, bought, sign=1.0, since=None):
+        '''
+        Runs loans bought in round bought to completion from the given state, adding sign
+        times their present value (rounds from since on) and cashflows (rounds after since)
+        to the calendar.
+        '''
+        since = bought if since is None else since
+        completes = np.empty(len(positions), dtype=np.int64)
+        completes.fill(self.never)
+
+        # loans whose realized term is not positive never complete, run them for the whole horizon
+        steps = self.horizon if (remaining_term <= 0).any() else min(remaining_term.max(), self.horizon)
+        self.reserve_rounds(bought + steps)
+        if bought >= since:
+            self.pv[bought] += sign * fold_sum(0, self.get_pv(positions))
+
+        held = np.arange(len(positions))
+        for step in range(1, steps + 1):
+            rows = positions[held]
+            fee = self.fee[rows]
+            amount[held], payment_received = pay_installment(amount[held], self.installment[rows], self.int_rate[rows], fee)
+            remaining_term[held] -= 1
+            imbalance[held] += payment_received
+
+            now = bought + step
+            done = remaining_term[held] == 0
+            finished = held[done]
+            imbalance[finished] -= self.total_payment[rows[done]] * (1.0 - fee[done])
+            completes[finished] = now
+            if now > since:
+                self.cash[now] += sign * fold_sum(0, payment_received * self.scale[rows])
+                self.defaults_due[now] += int(sign) * self.defaults[rows[done]].sum()
+                self.imbalance_due[now] += sign * fold_sum(0, imbalance[finished] * self.scale[rows[done]])
+                self.abs_imbalance_due[now] += sign * fold_sum(0, np.abs(imbalance[finished]) * self.scale[rows[done]])
+
+            held = held[~done]
+            if not len(held):
+                break
+            self.amount[positions[held]] = amount[held]
+            if now >= since:
+                self.pv[now] += sign * fold_sum(0, self.get_pv(positions[held]))
+
+        self.amount[positions] = amount
+        self.remaining_term[positions] = remaining_term
+        self.imbalance[positions] = imbalance
+        self.completes[positions] = completes
+        finished = positions[completes != self.never]
+        self.complete[finished] = True
+        self.imbalance_ratio[finished] = self.imbalance[finished] / self.total_payment[finished]
+
+    def remove_loans(self, positions):
+        '''
+        Drops held loans, taking their present value from this round on and their cashflows
+        after it out of the calendar. Their paths are replayed from purchase, starting from
+        the state loan_batch gives a new loan.
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        positions = positions[np.in1d(positions, self.active)]
+        for bought in np.unique(self.bought[positions]):
+            group = positions[self.bought[positions] == bought]
+            amount = np.where(self.defaults[group] != 0, self.total_payment[group], self.initial_amount[group])
+            remaining_term = month_ordinals(self.last_date[group]) - month_ordinals(self.issue_date[group])
+            self.simulate(group, amount, remaining_term, np.zeros(len(group)), bought, -1.0, self.round)
+        Portfolio.remove_loans(self, positions)
+
+    def advance(self):
+        '''
+        Moves to the next payment round.
+
+        returns: (cash, defaults, imbalance, abs_imbalance, completed) due this round,
+            completed being the row positions of the loans that finish
+        '''
+        self.round += 1
+        self.reserve_rounds(self.round)
+        now = self.round
+        finishing = self.completes[self.active] == now
+        completed = self.active[finishing]
+        self.active = self.active[~finishing]
+        return self.cash[now], self.defaults_due[now], self.imbalance_due[now], self.abs_imbalance_due[now], completed
+
+    def get_total_pv(self):
+        return self.pv[self.round]
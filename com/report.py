@@ -1,6 +1,115 @@
-from jinja2 import Template, Environment, PackageLoader
+import base64
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
 from collections import OrderedDict
 
+import numpy as np
+import pandas as pd
+
+from fingerprint import code_fingerprint
+
+
+def plot_net_worth(data, plt):
+    data['net worth'].plot(title='Net Worth', figsize=(18,8))
+
+def plot_monthly_return(data, plt):
+    data['monthly return'].plot(title='Monthly Returns', figsize=(6,8))
+
+def plot_mean_duration(data, plt):
+    data['duration'].mean(axis=1).plot(title='Mean Portfolio Remaning Lifetime', figsize=(6,8))
+
+def plot_default_rate(data, plt):
+    data['default rate'].plot(title='Default Rate', figsize=(6,8))
+
+def plot_growth_of_one(data, plt):
+    data['growth of $1'].plot(title='Growth of $1', )
+
+def plot_int_rate_breakdown(data, plt):
+    data['int_rate'].plot.hist(title='Distribution of Interest Rates', figsize=(6,8))
+
+def plot_grade_breakdown(data, plt):
+    (data['grade'] / data['grade'].sum()).plot.bar(title='Distribution of Grades', figsize=(6,8), colors='rgbymc')
+
+def plot_imbalance_percentage(data, plt):
+    imbalance = data['imbalance_percentage']
+    imbalance[imbalance.abs() <= 0.1].plot.hist(figsize=(6,8), title='Distribution of Loan Imbalance', bins=30)
+
+def plot_available_loans(data, plt):
+    data['available loans'].plot(title='Available Loans', figsize=(6, 8))
+
+def plot_loans_held(data, plt):
+    data['loans held'].plot(label='Loans Held', title='Loans Held', figsize=(6,8))
+    data['loans added'].plot(label='Loans Added', title='Loans Added', figsize=(6, 8))
+    plt.legend()
+
+def plot_cash_held(data, plt):
+    data['cash held'].plot(title='Cash Held', figsize=(6,8))
+
+def plot_liquidity(data, plt):
+    data['total liquidity'].plot(title='Liquidity (% Market Cap)', label='Total Liquidity', figsize=(6, 8))
+    data['strategy liquidity'].plot(label='Strategy Liquidity', figsize=(6, 8))
+    plt.legend()
+
+def plot_grade_monthly(data, plt):
+    data['grade'].plot(title='Monthly Breakdown by Grade', figsize=(10,8))
+
+def plot_grade_int_monthly(data, plt):
+    data['grade_int_rate'].plot(title='Monthly Interest Rate by Grade', figsize=(10,8))
+
+
+# chart name -> (plot function, the backtest series it draws)
+charts = OrderedDict([
+    ('net_worth', (plot_net_worth, [('stats', 'net worth')])),
+    ('monthly_return', (plot_monthly_return, [('stats', 'monthly return')])),
+    ('mean_duration', (plot_mean_duration, [('loan_stats', 'duration')])),
+    ('default_rate', (plot_default_rate, [('stats', 'default rate')])),
+    ('growth_of_one', (plot_growth_of_one, [('stats', 'growth of $1')])),
+    ('int_rate_breakdown', (plot_int_rate_breakdown, [('loan_stats_total', 'int_rate')])),
+    ('grade_breakdown', (plot_grade_breakdown, [('loan_stats_total', 'grade')])),
+    ('imbalance_percentage', (plot_imbalance_percentage, [('loan_stats_total', 'imbalance_percentage')])),
+    ('available_loans', (plot_available_loans, [('stats', 'available loans')])),
+    ('loans_held', (plot_loans_held, [('stats', 'loans held'), ('stats', 'loans added')])),
+    ('cash_held', (plot_cash_held, [('stats', 'cash held')])),
+    ('liquidity', (plot_liquidity, [('stats', 'total liquidity'), ('stats', 'strategy liquidity')])),
+    ('grade_monthly', (plot_grade_monthly, [('loan_stats', 'grade')])),
+    ('grade_int_monthly', (plot_grade_int_monthly, [('loan_stats', 'grade_int_rate')])),
+])
+
+
+def chart_data(bt, name):
+    _, inputs = charts[name]
+    return {key: getattr(bt, attribute)[key] for attribute, key in inputs}
+
+
+def chart_hash(name, data):
+    plot, _ = charts[name]
+    sha = hashlib.sha1(code_fingerprint(plot).encode('utf-8'))
+    for key in sorted(data):
+        sha.update(pickle.dumps((key, data[key]), 2))
+    return sha.hexdigest()
+
+
+def headless():
+    # pool initializer: workers render with Agg whatever backend pyplot had before the fork,
+    # the caller's own pyplot (e.g. a notebook's inline backend) is left alone
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+
+def render_chart(args):
+    name, data, filepath = args
+    import matplotlib.pyplot as plt
+
+    plot, _ = charts[name]
+    plot(data, plt)
+    plt.gcf().savefig(filepath)
+    plt.close('all')
+    return name
+
 
 class Report():
 
@@ -8,12 +117,22 @@ class Report():
         self.backtest = backtest
         self.filepath = filepath
 
-    def save(self, filepath=None):
+    def save(self, filepath=None, processes=None, embed=False):
+        '''
+        Renders the charts and writes the HTML report.
+
+        Charts are written to a folder next to the report (report.html -> report_files/) and
+        rendered in parallel on a process pool. A chart is skipped when the series it draws
+        are unchanged since it was last rendered there.
+        :param processes: int, pool size, defaults to the number of cores. Charts are always
+            rendered on worker processes, so the caller's pyplot backend and figures are untouched
+        :param embed: bool, inline the charts in the HTML as base64 images
+        '''
         if not filepath:
             filepath = self.filepath
 
         bt = self.backtest
-        
+
         summary_dict = OrderedDict()
         summary_dict['Title'] = 'Lending Club Report'
         summary_dict['Date'] = str(datetime.datetime.now()).split('.')[0]
@@ -26,80 +145,62 @@ class Report():
         summary_dict['Kurtosis'] = np.round(bt.stats['monthly return'].kurt(), 3)
         summary_dict['Sharpe'] = np.round(bt.stats_dict['sharpe'], 3)
         summary_dict['Transaction Fee'] = 0.01
-        
+
         summary_df = pd.Series(summary_dict)
-        
-        net_worth = bt.stats['net worth'].plot(title='Net Worth', figsize=(18,8))
-        net_worth.get_figure().savefig('net_worth.png')
-        plt.close()    
-        
-        monthly_return = bt.stats['monthly return'].plot(title='Monthly Returns', figsize=(6,8))
-        monthly_return.get_figure().savefig('monthly_return.png')
-        plt.close()
-        
-        mean_duration = bt.loan_stats['duration'].mean(axis=1).plot(title='Mean Portfolio Remaning Lifetime', figsize=(6,8))
-        mean_duration.get_figure().savefig('mean_duration.png')
-        plt.close()
-        
-        default_rate = bt.stats['default rate'].plot(title='Default Rate', figsize=(6,8))
-        default_rate.get_figure().savefig('default_rate.png')
-        plt.close()
-
-        growth_of_one = bt.stats['growth of $1'].plot(title='Growth of $1', )
-        growth_of_one.get_figure().savefig('growth_of_one.png')
-        plt.close()
-        
-        int_rate_breakdown = bt.loan_stats_total['int_rate'].plot.hist(title='Distribution of Interest Rates', figsize=(6,8))
-        int_rate_breakdown.get_figure().savefig('int_rate_breakdown.png')
-        plt.close()
-
-        grade_breakdown = (bt.loan_stats_total['grade'] / bt.loan_stats_total['grade'].sum()).plot.bar(title='Distribution of Grades', figsize=(6,8), colors='rgbymc')
-        grade_breakdown.get_figure().savefig('grade_breakdown.png')
-        plt.close()
-        
-        imbalance_percentage = bt.loan_stats_total['imbalance_percentage'][bt.loan_stats_total['imbalance_percentage'].abs() <= 0.1].plot.hist(figsize=(6,8), title='Distribution of Loan Imbalance', bins=30)
-        imbalance_percentage.get_figure().savefig('imbalance_percentage.png')
-        plt.close()
-        
-        available_loans = bt.stats['available loans'].plot(title='Available Loans', figsize=(6, 8))
-        available_loans.get_figure().savefig('available_loans.png')
-        plt.close()  
-        
-        
-        loans_held = bt.stats['loans held'].plot(label='Loans Held', title='Loans Held', figsize=(6,8))
-        bt.stats['loans added'].plot(label='Loans Added', title='Loans Added', figsize=(6, 8))
-        plt.legend()
-        loans_held.get_figure().savefig('loans_held.png')
-        plt.close()
-        
-        cash_held = bt.stats['cash held'].plot(title='Cash Held', figsize=(6,8))
-        cash_held.get_figure().savefig('cash_held.png')
-        plt.close()
-        
-        liquidity = bt.stats['total liquidity'].plot(title='Liquidity (% Market Cap)', label='Total Liquidity', figsize=(6, 8))
-        bt.stats['strategy liquidity'].plot(label='Strategy Liquidity', figsize=(6, 8))
-        plt.legend()
-        liquidity.get_figure().savefig('liquidity.png')
-        plt.close()
-        
-        
-        grade_monthly = (bt.loan_stats['grade']).plot(title='Monthly Breakdown by Grade', figsize=(10,8))
-        grade_monthly.get_figure().savefig('grade_monthly.png')
-        plt.close()
-        
-        grade_int_monthly = bt.loan_stats['grade_int_rate'].plot(title='Monthly Interest Rate by Grade', figsize=(10,8))
-        grade_int_monthly.get_figure().savefig('grade_int_monthly.png')
-        plt.close()
-            
+
+        images = self.render_charts(filepath, processes)
+        if embed:
+            images = {name: 'data:image/png;base64,' + base64.b64encode(open(path, 'rb').read()).decode('ascii')
+                      for name, path in images.items()}
+        else:
+            report_dir = os.path.dirname(os.path.abspath(filepath))
+            images = {name: os.path.relpath(path, report_dir) for name, path in images.items()}
+
+        # loaded here, processes that only run backtests never import jinja2
+        from jinja2 import Environment, PackageLoader
         env = Environment(loader=PackageLoader('reports', 'templates'))
         template = env.get_template('template.html')
         css = env.get_template('report.css')
-        
+
         output = template.render(
             css=css.render(),
-            summary = pd.DataFrame(summary_df).to_html()
+            summary = pd.DataFrame(summary_df).to_html(),
+            images=images
         )
-        
+
         with open(filepath, 'w') as fp:
             fp.write(output)
-        return output
\ No newline at end of file
+        return output
+
+    def render_charts(self, filepath, processes=None):
+        '''
+        returns: dict, chart name -> path of its png
+        '''
+        chart_dir = os.path.splitext(filepath)[0] + '_files'
+        if not os.path.exists(chart_dir):
+            os.makedirs(chart_dir)
+        manifest_file = os.path.join(chart_dir, 'charts.json')
+        manifest = json.load(open(manifest_file)) if os.path.exists(manifest_file) else dict()
+
+        paths = OrderedDict()
+        jobs = []
+        hashes = dict()
+        for name in charts:
+            paths[name] = os.path.join(chart_dir, name + '.png')
+            data = chart_data(self.backtest, name)
+            hashes[name] = chart_hash(name, data)
+            if manifest.get(name) != hashes[name] or not os.path.exists(paths[name]):
+                jobs.append((name, data, paths[name]))
+
+        if jobs:
+            pool = multiprocessing.Pool(min(len(jobs), processes or multiprocessing.cpu_count()), initializer=headless)
+            try:
+                pool.map(render_chart, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        manifest.update((name, hashes[name]) for name, _, _ in jobs)
+        with open(manifest_file, 'w') as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+        return paths
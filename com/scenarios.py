@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from loan import loan_batch
+from month_index import get_month_index
+from portfolio import pay_installment
+
+
+class ScenarioBacktest():
+    '''
+    Many randomized versions of a Backtest run together, one row per scenario in every array.
+
+    Each month every scenario receives its loans' payments, buys from the month's pool and
+    values its book, like Backtest with a PortfolioInvestor. Randomness, all optional:
+
+    - bootstrap: each scenario's pool of the month is resampled with replacement from the
+      month's loans, so a loan can be bought more than once
+    - liquidity: (low, high), each scenario's liquidity limit is drawn uniformly every month
+    - default_timing: a defaulted loan pays its total_payment over a number of months drawn
+      uniformly from 1 to its term, instead of up to its recorded last payment
+
+    A loan's payments follow from its purchase alone, so a purchase's whole cashflow is
+    added to per-scenario calendars (cash, present value, loans held, defaults) when it is
+    made, and a month costs a few array operations across all scenarios. With no randomness
+    every scenario matches Backtest(..., investor_class=PortfolioInvestor) up to float rounding.
+
+    :param solver: RankedSolver, its filters and ranking are evaluated once over the db
+    :param scenarios: int, number of scenarios
+    :param seed: int, seeds the random draws
+    '''
+    def __init__(self, sdate, edate, solver, db, scenarios=1000, cash=1000, buy_size=25.0, liquidity_limit=1.0,
+                 bootstrap=True, liquidity=None, default_timing=False, seed=None, month_index=None):
+        if not (hasattr(solver, 'mask') and hasattr(solver, 'keys')):
+            raise TypeError('scenarios need a declarative solver (RankedSolver), got {}'.format(solver))
+        self.months = pd.period_range(sdate, edate, freq='M')
+        self.solver = solver
+        self.db = db
+        self.month_index = month_index or get_month_index(db)
+        self.scenarios = scenarios
+        self.cash = cash
+        self.buy_size = buy_size
+        self.liquidity_limit = liquidity_limit
+        self.bootstrap = bootstrap
+        self.liquidity = liquidity
+        self.default_timing = default_timing
+        self.random = np.random.RandomState(seed)
+
+    def solver_arrays(self):
+        compiled = self.solver.compiled.get(self.month_index) if hasattr(self.solver, 'compiled') else None
+        if compiled is not None:
+            return compiled
+        db = self.month_index.db
+        return self.month_index.in_month_order(self.solver.mask(db)), self.month_index.in_month_order(self.solver.keys(db))
+
+    def draw_pool(self, candidates, available):
+        '''
+        How many times each scenario draws each candidate, candidates in rank order.
+
+        returns: (counts, scenarios x candidates; matching quantity per scenario)
+        '''
+        count = len(candidates)
+        if not self.bootstrap:
+            return np.ones((self.scenarios, count), dtype=np.int64), np.repeat(count, self.scenarios)
+        if not count:
+            return np.zeros((self.scenarios, 0), dtype=np.int64), np.zeros(self.scenarios, dtype=np.int64)
+        # of the available draws, those landing on a candidate, the rest being loans the solver
+        # filters out, then those split evenly among the candidates (a uniform multinomial)
+        hits = self.random.binomial(available, count / float(available), size=self.scenarios)
+        scenario = np.repeat(np.arange(self.scenarios), hits)
+        drawn = self.random.randint(0, count, size=len(scenario))
+        counts = np.bincount(scenario * count + drawn, minlength=self.scenarios * count)
+        return counts.reshape(self.scenarios, count), hits
+
+    def liquidity_limits(self):
+        if self.liquidity is None:
+            return np.repeat(self.liquidity_limit, self.scenarios)
+        low, high = self.liquidity
+        return self.random.uniform(low, high, self.scenarios)
+
+    def schedule(self, month, batch, scenario, candidate, multiplicity):
+        '''
+        Adds the cashflows of the loans bought this month to the calendars.
+
+        :param scenario, candidate, multiplicity: one entry per (scenario, loan) bought
+        '''
+        amount = batch['amount'][candidate]
+        installment = batch['installment'][candidate]
+        payments = batch['term_realized'][candidate]
+        defaults = batch['defaults'][candidate]
+        int_rate = batch['int_rate'][candidate]
+        fee = batch['fee'][candidate]
+        scale = batch['scale'][candidate] * multiplicity
+        # defaulted loans are valued at the principal still due, see Loan.get_pv
+        written_off = np.where(defaults != 0, batch['initial_amount'][candidate] - batch['total_payment'][candidate], 0)
+
+        if self.default_timing:
+            defaulted = np.nonzero(defaults != 0)[0]
+            payments = payments.copy()
+            payments[defaulted] = 1 + np.floor(self.random.rand(len(defaulted)) *
+                                               batch['term'][candidate][defaulted]).astype(np.int64)
+            installment = installment.copy()
+            installment[defaulted] = np.round(-np.pmt(int_rate[defaulted] / 12, payments[defaulted],
+                                                      amount[defaulted]), 2)
+
+        completes = month + payments
+        ends = completes < len(self.months)
+        self.defaults_due[:, :] += np.bincount(scenario[ends] * len(self.months) + completes[ends],
+                                               weights=(multiplicity * (defaults != 0))[ends],
+                                               minlength=self.defaults_due.size).reshape(self.defaults_due.shape)
+
+        age = 0
+        while age < payments.max() and month + age < len(self.months):
+            held = age < payments
+            self.pv_due[:, month + age] += np.bincount(scenario, weights=held * (amount + written_off) * scale,
+                                                       minlength=self.scenarios)
+            self.held_due[:, month + age] += np.bincount(scenario, weights=held * multiplicity,
+                                                         minlength=self.scenarios)
+            paid, received = pay_installment(amount, installment, int_rate, fee)
+            amount = np.where(held, paid, amount)
+            if month + age + 1 < len(self.months):
+                self.cash_due[:, month + age + 1] += np.bincount(scenario, weights=held * received * scale,
+                                                                 minlength=self.scenarios)
+            age += 1
+
+    def run(self):
+        '''
+        returns: pandas.DataFrame, one row per scenario with its final net worth, sharpe and
+            mean monthly default rate
+        '''
+        scenarios, month_count = self.scenarios, len(self.months)
+        self.cash_due = np.zeros((scenarios, month_count))
+        self.pv_due = np.zeros((scenarios, month_count))
+        self.held_due = np.zeros((scenarios, month_count))
+        self.defaults_due = np.zeros((scenarios, month_count))
+        cash_held = np.zeros((scenarios, month_count))
+        balance = np.repeat(float(self.cash), scenarios)
+        mask, keys = self.solver_arrays()
+        db = self.month_index.db
+
+        for month_number, month in enumerate(self.months):
+            balance += self.cash_due[:, month_number]
+            start, stop = self.month_index.get_bounds(month)
+            candidates = np.nonzero(mask[start:stop])[0]
+            candidates = candidates[np.lexsort((candidates, keys[start:stop][candidates]))]
+
+            counts, matching = self.draw_pool(candidates, stop - start)
+            number = np.minimum(np.floor(balance / self.buy_size), np.floor(self.liquidity_limits() * matching))
+            if self.solver.number is not None:
+                number = np.minimum(number, self.solver.number)
+            number = np.maximum(number, 0).astype(np.int64)
+            # top loans up to number per scenario, counting a loan drawn twice twice
+            drawn_before = np.cumsum(counts, axis=1) - counts
+            multiplicity = np.clip(number[:, np.newaxis] - drawn_before, 0, counts)
+            balance -= multiplicity.sum(axis=1) * self.buy_size
+            cash_held[:, month_number] = balance
+
+            scenario, candidate = np.nonzero(multiplicity)
+            if len(scenario):
+                batch = loan_batch(db.iloc[self.month_index.positions(start, stop)[candidates]], self.buy_size)
+                self.schedule(month_number, batch, scenario, candidate, multiplicity[scenario, candidate])
+
+        net_worth = cash_held + self.pv_due
+        self.net_worth = pd.DataFrame(net_worth.T, index=self.months)
+        self.cash_held = pd.DataFrame(cash_held.T, index=self.months)
+        self.loans_held = pd.DataFrame(self.held_due.T, index=self.months)
+        self.default_rate = pd.DataFrame(self.defaults_due.T, index=self.months) / self.loans_held.replace(0, np.nan)
+        self.default_rate.iloc[0] = np.nan
+
+        changes = np.diff(net_worth, axis=1)
+        self.results = pd.DataFrame({
+            'net worth': net_worth[:, -1],
+            'sharpe': changes.mean(axis=1) / changes.std(axis=1, ddof=1) * np.sqrt(12),
+            'default rate': self.default_rate.mean(),
+        }, columns=['net worth', 'sharpe', 'default rate'])
+        self.results.index.name = 'scenario'
+        return self.results
+
+    def distributions(self, percentiles=[0.05, 0.25, 0.5, 0.75, 0.95]):
+        '''
+        returns: pandas.DataFrame, summary statistics of each result across scenarios
+        '''
+        return self.results.describe(percentiles=percentiles)
@@ -0,0 +1,118 @@
+import hashlib
+import inspect
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from fingerprint import code_fingerprint, frame_fingerprint
+
+
+def model_fingerprint(model):
+    '''
+    Hash of a scoring model: the source of its function or class and, for a fitted model
+    (a callable object or a bound method), its pickled state. A model with a ``fingerprint``
+    attribute is keyed by that instead.
+    '''
+    if hasattr(model, 'fingerprint'):
+        return str(model.fingerprint)
+    if inspect.isfunction(model):
+        return code_fingerprint(model)
+    state = model.__self__ if inspect.ismethod(model) else model
+    sha = hashlib.sha1()
+    sha.update(code_fingerprint(model if inspect.ismethod(model) else type(model)))
+    try:
+        sha.update(pickle.dumps(state, 2))
+    except (pickle.PicklingError, TypeError):
+        sha.update(repr(state))
+    return sha.hexdigest()
+
+
+class ScoreCache():
+    '''
+    Model scores of every loan of the historic table, computed once per model and data.
+
+    A solver that scores month_db with a model on every Backtest.buy redoes the same work
+    for every month of every backtest and sweep point, though a loan's score never changes.
+    Here the whole table is scored in batches and saved under the model and data
+    fingerprints; later calls memory map the saved scores.
+
+        cache = ScoreCache('data/loan_scores/')
+        db = cache.add_scores(db, fit.predict, name='predicted profit')
+        solver = RankedSolver('predicted profit', rank_by='predicted profit', number=10)
+
+    RankedSolver then ranks the column once over the table, so each month is a slice and a
+    top-k pick. add_scores returns a new DataFrame, with its own MonthIndex, so one solver
+    can rank the scores of several models added to the same table, each Backtest reading
+    the ranking of its own db.
+    :param path: str, folder of the saved scores
+    '''
+    def __init__(self, path, batch_size=100000):
+        self.path = path
+        self.batch_size = batch_size
+
+    def filepath(self, model_key, data_key):
+        return os.path.join(self.path, '{}_{}.npy'.format(model_key, data_key))
+
+    def scores(self, model, db, columns=None, data_key=None):
+        '''
+        :param model: callable, DataFrame -> a score per row
+        :param columns: list, the columns the model reads: only those are hashed and passed to it
+        :param data_key: str, fingerprint of db when already known (e.g. of its source files)
+        returns: numpy array, a score per row of db
+        '''
+        data_key = data_key or frame_fingerprint(db, columns)
+        filepath = self.filepath(model_fingerprint(model), data_key)
+        if os.path.exists(filepath):
+            return np.load(filepath, mmap_mode='r')
+
+        frame = db if columns is None else db[columns]
+        scores = np.empty(len(frame))
+        for start in range(0, len(frame), self.batch_size):
+            stop = min(start + self.batch_size, len(frame))
+            scores[start:stop] = np.asarray(model(frame.iloc[start:stop]), dtype=float)
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        tmp_path = filepath + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            np.save(fp, scores)
+        os.rename(tmp_path, filepath)
+        return scores
+
+    def add_scores(self, db, model, name='score', columns=None, data_key=None):
+        '''
+        returns: db with the model's scores as column name
+        '''
+        db = db.copy()
+        db[name] = np.asarray(self.scores(model, db, columns, data_key))
+        return db
+
+    def score_series(self, model, db, name='score', columns=None, data_key=None):
+        '''
+        returns: pandas.Series of the scores by loan id, e.g. for a ScoredSource
+        '''
+        return pd.Series(np.asarray(self.scores(model, db, columns, data_key)), index=db['id'].values, name=name)
+
+
+class ScoredSource():
+    '''
+    A month source (e.g. PartitionedSource) with cached scores joined to each month by loan id.
+
+    :param scores: pandas.Series of scores by loan id, see ScoreCache.score_series
+    '''
+    def __init__(self, source, scores):
+        self.source = source
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.source)
+
+    def months(self):
+        return self.source.months()
+
+    def get(self, month):
+        df = self.source.get(month)
+        df[self.scores.name] = self.scores.reindex(df['id'].values).values if len(df) else []
+        return df
@@ -0,0 +1,140 @@
+import operator
+import weakref
+
+import numpy as np
+
+from compact import dummy_sources, is_dummy, with_dummies
+
+operators = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'in': lambda values, options: np.in1d(values, list(options)),
+}
+
+
+class RankedSolver():
+    '''
+    A buy solver declared as filters plus a ranking column, callable like any other solver.
+
+    Backtest compiles it against the db's MonthIndex: the filter mask and the ranking key
+    are computed once over the whole historic table, and each month (see select) only slices
+    them and picks its top loans with np.argpartition instead of sorting the month. Called
+    directly it evaluates the month_db it is given.
+
+    :param name: str, shown as the Backtest's buy_solver_name
+    :param filters: list of (column, op, value), op one of >, >=, <, <=, ==, !=, in
+    :param rank_by: str, column the best loans have the highest (or with ascending, lowest) value of,
+        loans keep their db order when None
+    :param number: int, most loans to buy a month, on top of the cash and liquidity limits
+    '''
+    def __init__(self, name, filters=None, rank_by=None, ascending=False, number=None):
+        self.name = name
+        self.filters = filters or []
+        self.rank_by = rank_by
+        self.ascending = ascending
+        self.number = number
+        # MonthIndex -> (mask, keys) in month order, not keeping the MonthIndex or its db alive
+        self.compiled = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['compiled']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compiled = weakref.WeakKeyDictionary()
+
+    def mask(self, df):
+        mask = np.ones(len(df), dtype=bool)
+        for column, op, value in self.filters:
+            values = self.column(df, column)
+            mask &= np.asarray(operators[op](values, value), dtype=bool)
+        return mask
+
+    def keys(self, df):
+        if self.rank_by is None:
+            return np.arange(len(df), dtype=float)
+        keys = np.asarray(self.column(df, self.rank_by), dtype=float)
+        keys = keys if self.ascending else -keys
+        # missing values rank last, as with DataFrame.sort
+        keys[np.isnan(keys)] = np.inf
+        return keys
+
+    def column(self, df, column):
+        if column not in df.columns and is_dummy(column):
+            return with_dummies(df[['addr_state', 'purpose']], [column])[column].values
+        return df[column].values
+
+    def columns(self):
+        '''
+        The db columns the filters and ranking read, e.g. to load from a PartitionedSource.
+        '''
+        names = [column for column, _, _ in self.filters] + ([self.rank_by] if self.rank_by else [])
+        columns = []
+        for name in names:
+            if is_dummy(name):
+                name = [source for prefix, source in dummy_sources.items() if name.startswith(prefix)][0]
+            if name not in columns:
+                columns.append(name)
+        return columns
+
+    def compile(self, month_index):
+        if not hasattr(month_index, 'db'):
+            # out-of-core sources only have one month in memory, each month is solved on its own
+            return
+        db = month_index.db
+        self.compiled[month_index] = (month_index.in_month_order(self.mask(db)),
+                                      month_index.in_month_order(self.keys(db)))
+
+    def __call__(self, month, investor, month_db, number, liquidity_limit):
+        return self.pick(month_db, self.mask(month_db), self.keys(month_db), number, liquidity_limit)
+
+    def select(self, month_index, month, investor, month_db, number, liquidity_limit):
+        '''
+        The solver's pick for month of month_index, month_db being month_index.get(month), from
+        the arrays compiled for month_index (evaluated on month_db when it was not compiled).
+        '''
+        compiled = self.compiled.get(month_index)
+        if compiled is None:
+            return self(month, investor, month_db, number, liquidity_limit)
+        start, stop = month_index.get_bounds(month)
+        return self.pick(month_db, compiled[0][start:stop], compiled[1][start:stop], number, liquidity_limit)
+
+    def pick(self, month_db, matches, keys, number, liquidity_limit):
+        candidates = np.nonzero(matches)[0]
+        matching_quantity = len(candidates)
+        number = min(number, int(np.floor(liquidity_limit * matching_quantity)))
+        if self.number is not None:
+            number = min(number, self.number)
+        return {
+            'loans': month_db.iloc[top_k(candidates, keys[candidates], max(number, 0))],
+            'matching quantity': matching_quantity,
+            'available quantity': month_db.shape[0]
+        }
+
+
+def top_k(positions, keys, number):
+    '''
+    The number positions with the smallest keys, ordered by key (ties by position).
+    '''
+    if number < len(positions):
+        if number == 0:
+            return positions[:0]
+        kth = np.partition(keys, number - 1)[number - 1]
+        below = np.nonzero(keys < kth)[0]
+        tied = np.nonzero(keys == kth)[0][:number - len(below)]
+        chosen = np.concatenate([below, tied])
+        positions, keys = positions[chosen], keys[chosen]
+    return positions[np.lexsort((positions, keys))]
+
+
+simple_filter_solver = RankedSolver(
+    'Simple Filter (compiled)',
+    filters=[('emp_length', '>', 5.0), ('own_home', '==', 1), ('total_acc', '>', 15)],
+    rank_by='annual_inc',
+)
@@ -0,0 +1,103 @@
+import numpy as np
+
+
+def _ratio(numerator, denominator):
+    return numerator / float(denominator) if denominator else np.nan
+
+
+class OnlineStats():
+    '''
+    The stats Backtest.run derives from its whole stats table, updated one month at a time
+    in constant memory.
+
+    Added to each month's row:
+    - defaults, default rate, growth of $1 and the liquidity ratios, as in Backtest.run
+    - return: net worth change since the previous month over its net worth, run's
+      monthly return of the previous month
+    - mean return, sharpe: of the returns and net worth changes so far, sharpe as in run's stats_dict
+    - peak net worth, drawdown (net worth below its peak so far, as a fraction of the peak)
+      and max drawdown
+    '''
+    def __init__(self):
+        self.months = 0
+        self.first_net_worth = None
+        self.last = None
+        self.peak = -np.inf
+        self.max_drawdown = 0.0
+        # Welford accumulators of the monthly net worth changes and of the returns
+        self.changes = 0
+        self.change_mean = 0.0
+        self.change_m2 = 0.0
+        self.return_sum = 0.0
+
+    def update(self, month, row):
+        '''
+        returns: dict, row with month and the derived stats added
+        '''
+        net_worth = row['net worth']
+        last = self.last
+        self.months += 1
+        if self.first_net_worth is None:
+            self.first_net_worth = net_worth
+
+        row['month'] = month
+        row['months solved'] = self.months
+        row['defaults'] = row['cumulative defaults'] - last['cumulative defaults'] if last else np.nan
+        row['return'] = _ratio(net_worth - last['net worth'], last['net worth']) if last else np.nan
+        if last:
+            change = net_worth - last['net worth']
+            self.changes += 1
+            delta = change - self.change_mean
+            self.change_mean += delta / self.changes
+            self.change_m2 += delta * (change - self.change_mean)
+            self.return_sum += row['return']
+        row['mean return'] = self.return_sum / self.changes if self.changes else np.nan
+        row['sharpe'] = self.sharpe()
+
+        row['total liquidity'] = _ratio(row['loans added'], row['available loans'])
+        row['strategy liquidity'] = _ratio(row['loans added'], row['strategy available loans'])
+        row['strategy vs total liquidity'] = _ratio(row['strategy available loans'], row['available loans'])
+        row['default rate'] = _ratio(row['defaults'], row['loans held'])
+        row['growth of $1'] = _ratio(net_worth, self.first_net_worth)
+
+        self.peak = max(self.peak, net_worth)
+        row['peak net worth'] = self.peak
+        row['drawdown'] = _ratio(self.peak - net_worth, self.peak)
+        self.max_drawdown = max(self.max_drawdown, row['drawdown'])
+        row['max drawdown'] = self.max_drawdown
+
+        # only what the next month needs
+        self.last = {'net worth': net_worth, 'cumulative defaults': row['cumulative defaults']}
+        return row
+
+    def sharpe(self):
+        if self.changes < 2:
+            return np.nan
+        std = np.sqrt(self.change_m2 / (self.changes - 1))
+        return self.change_mean / std * np.sqrt(12) if std else np.nan
+
+
+def stop_on_drawdown(limit, min_months=0):
+    '''
+    Stop once net worth is more than limit (a fraction) below its peak so far.
+    '''
+    return lambda row: row['drawdown'] > limit and _months(row) >= min_months
+
+
+def stop_below_net_worth(threshold, min_months=0):
+    return lambda row: row['net worth'] < threshold and _months(row) >= min_months
+
+
+def stop_below_sharpe(threshold, min_months=12):
+    '''
+    Stop once the sharpe so far is below threshold, after min_months to let it settle.
+    '''
+    return lambda row: row['sharpe'] < threshold and _months(row) >= min_months
+
+
+def stop_any(*rules):
+    return lambda row: any(rule(row) for rule in rules)
+
+
+def _months(row):
+    return row['months solved']
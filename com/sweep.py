@@ -0,0 +1,59 @@
+import itertools
+import multiprocessing
+
+import pandas as pd
+
+from backtest import Backtest, solver_name
+from month_index import get_month_index
+
+# filled in before the pool forks, so workers read db from memory inherited from the parent
+_shared = dict()
+
+
+def parameter_grid(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def _run_backtest(params):
+    bt = Backtest(db=_shared['db'], month_index=_shared['month_index'], **params)
+    stats = bt.run()
+    for name, value in bt.stats_dict.iteritems():
+        stats[name] = value
+    return stats
+
+
+def _label(name, value):
+    if name == 'buy_solver':
+        return solver_name(value)
+    return value
+
+
+def run_sweep(db, grid, processes=None, **fixed):
+    '''
+    Runs a Backtest for every combination of grid over a pool of forked processes.
+
+    :param db: pandas.DataFrame, the historic loans. Workers inherit it (and its month index)
+        from the parent process when the pool forks, nothing is pickled per run
+    :param grid: dict, Backtest argument -> list of values, e.g. {'buy_solver': [...], 'liquidity_limit': [0.2, 0.4]}
+    :param processes: int, pool size, defaults to the number of cores
+    :param fixed: Backtest arguments shared by every run, e.g. sdate, edate
+
+    returns: pandas.DataFrame, every run's stats with its stats_dict values (e.g. sharpe) as
+        extra columns, indexed by the swept parameters and month
+    '''
+    runs = [dict(fixed, **params) for params in parameter_grid(grid)]
+    names = sorted(grid)
+
+    _shared['db'] = db
+    _shared['month_index'] = get_month_index(db)
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_run_backtest, runs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        _shared.clear()
+
+    keys = [tuple(_label(name, run[name]) for name in names) for run in runs]
+    return pd.concat(results, keys=keys, names=names + ['month'])
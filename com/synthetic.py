@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from lc_helpers import get_db_folder, historic_sources, parse_months
+from month_index import month_ordinals
+
+grades = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+grade_shares = [0.18, 0.29, 0.25, 0.15, 0.08, 0.04, 0.01]
+# interest rate of each grade's first sub grade, each sub grade after it adds sub_grade_step
+grade_rates = [6.0, 9.5, 13.0, 16.0, 19.0, 22.0, 24.5]
+sub_grade_step = 0.7
+# share of 36 month loans that charge off, 60 month loans default more
+grade_default_rates = [0.06, 0.11, 0.16, 0.22, 0.27, 0.32, 0.36]
+long_term_default_factor = 1.4
+
+states = ['CA', 'NY', 'TX', 'FL', 'IL', 'NJ', 'PA', 'OH', 'GA', 'VA', 'NC', 'MI', 'MA', 'MD', 'AZ', 'WA', 'CO',
+          'MN', 'MO', 'CT', 'NV', 'IN', 'OR', 'WI', 'TN', 'AL', 'LA', 'SC', 'KY', 'OK', 'KS', 'UT', 'AR', 'NM',
+          'HI', 'WV', 'NH', 'RI', 'MS', 'MT', 'DE', 'DC', 'AK', 'WY', 'SD', 'VT', 'NE', 'ME', 'ID', 'ND']
+purposes = ['debt_consolidation', 'credit_card', 'home_improvement', 'other', 'major_purchase', 'small_business',
+            'car', 'medical', 'moving', 'wedding', 'house', 'vacation', 'educational', 'renewable_energy']
+purpose_shares = [0.55, 0.2, 0.06, 0.06, 0.03, 0.02, 0.02, 0.015, 0.01, 0.01, 0.008, 0.007, 0.005, 0.005]
+emp_lengths = ['< 1 year', '1 year', '2 years', '3 years', '4 years', '5 years', '6 years', '7 years', '8 years',
+               '9 years', '10+ years', 'n/a']
+emp_length_shares = [0.08, 0.07, 0.09, 0.08, 0.06, 0.07, 0.06, 0.05, 0.05, 0.04, 0.31, 0.04]
+
+# historic source -> last issue month its LoanStats file holds, as LendingClub splits its history
+source_last_months = {'training': '2011-12', 'testing': '2013-12', 'testing2': '2014-12', 'testing3': None}
+
+
+def _zipf_shares(count):
+    weights = 1.0 / np.arange(1, count + 1) ** 0.9
+    return weights / weights.sum()
+
+
+def _format_months(ordinals, fmt='%b-%y'):
+    low, high = ordinals.min(), ordinals.max()
+    labels = np.array([pd.Period(ordinal=ordinal, freq='M').strftime(fmt) for ordinal in range(low, high + 1)],
+                      dtype=object)
+    return labels[ordinals - low]
+
+
+def _with_missing(rs, values, share):
+    values = np.asarray(values, dtype=object)
+    values[rs.rand(len(values)) < share] = np.nan
+    return values
+
+
+def balance_after(amount, rate, installment, payments):
+    '''
+    Principal left on an amortizing loan after a number of monthly installments.
+    '''
+    growth = (1 + rate) ** payments
+    return np.maximum(amount * growth - installment * (growth - 1) / rate, 0)
+
+
+def make_loan_stats(n, seed=0, sdate='2007-06', edate='2015-12', as_of='2016-12', growth=0.04):
+    '''
+    A seeded, synthetic LoanStats table shaped like LendingClub's raw download.
+
+    Loans are issued from sdate to edate, with volume growing by growth a month. Grades set
+    the interest rate and how often a loan charges off, terms are 36 or 60 months, and loans
+    either pay to term, prepay or charge off part way, with payments, recoveries and dates
+    consistent with their amortization. Loans still running at as_of are Current.
+    :param n: int, number of loans
+    '''
+    rs = np.random.RandomState(seed)
+    months = pd.period_range(sdate, edate, freq='M')
+    month_weights = np.exp(growth * np.arange(len(months)))
+    issue = months[0].ordinal + np.sort(rs.choice(len(months), n, p=month_weights / month_weights.sum()))
+    as_of = pd.Period(as_of, freq='M').ordinal
+
+    grade = rs.choice(len(grades), n, p=grade_shares)
+    sub_grade = rs.randint(0, 5, n)
+    int_rate = np.round(np.take(grade_rates, grade) + sub_grade_step * sub_grade + rs.normal(0, 0.3, n), 2)
+    term = np.where(rs.rand(n) < 0.75, 36, 60)
+
+    funded_amnt = np.clip(np.round(rs.lognormal(np.log(11000), 0.6, n) / 25) * 25, 1000, 35000)
+    loan_amnt = np.where(rs.rand(n) < 0.05, np.minimum(funded_amnt + 25 * rs.randint(1, 40, n), 35000), funded_amnt)
+    rate = int_rate / 1200
+    installment = np.round(funded_amnt * rate / (1 - (1 + rate) ** -term), 2)
+
+    # outcome: charge off after some payments, prepay, or pay to term
+    default_rate = np.take(grade_default_rates, grade) * np.where(term == 60, long_term_default_factor, 1.0)
+    charged_off = rs.rand(n) < default_rate
+    prepaid = ~charged_off & (rs.rand(n) < 0.3)
+    months_paid = term.copy()
+    months_paid[charged_off] = np.floor(rs.beta(1.5, 3, charged_off.sum()) * (term[charged_off] - 1)).astype(int)
+    months_paid[prepaid] = 1 + np.floor(rs.rand(prepaid.sum()) * (term[prepaid] - 1)).astype(int)
+    running = issue + np.maximum(months_paid, 1) > as_of
+    months_paid = np.where(running, as_of - issue, months_paid)
+
+    balance = balance_after(funded_amnt, rate, installment, months_paid)
+    recoveries = np.where(charged_off & ~running, np.round(balance * rs.uniform(0, 0.15, n), 2), 0.0)
+    total_rec_prncp = np.round(np.where(charged_off | running, funded_amnt - balance, funded_amnt), 2)
+    total_pymnt = np.round(installment * months_paid + np.where(prepaid & ~running, balance, 0) + recoveries, 2)
+
+    loan_status = np.where(running, 'Current', np.where(charged_off, 'Charged Off', 'Fully Paid')).astype(object)
+    early = (issue < pd.Period('2010-11', freq='M').ordinal) & ~running & (rs.rand(n) < 0.05)
+    loan_status[early] = 'Does not meet the credit policy. Status:' + loan_status[early]
+    last_pymnt_d = _with_missing(rs, _format_months(issue + np.maximum(months_paid, 1)), 0.002)
+
+    open_acc = rs.poisson(9, n) + 1
+    revol_util = _with_missing(rs, np.char.mod('%.1f%%', np.round(rs.beta(2, 2, n) * 100, 1)), 0.001)
+    return pd.DataFrame({
+        'id': 1000000 + np.arange(n),
+        'member_id': 5000000 + np.arange(n),
+        'loan_amnt': loan_amnt,
+        'funded_amnt': funded_amnt,
+        'term': np.where(term == 36, ' 36 months', ' 60 months'),
+        'int_rate': np.char.mod('%.2f%%', int_rate),
+        'installment': installment,
+        'grade': np.take(grades, grade),
+        'sub_grade': np.char.add(np.take(grades, grade), (sub_grade + 1).astype(str)),
+        'emp_length': np.asarray(emp_lengths, dtype=object)[rs.choice(len(emp_lengths), n, p=emp_length_shares)],
+        'home_ownership': np.take(['RENT', 'MORTGAGE', 'OWN', 'OTHER'], rs.choice(4, n, p=[0.45, 0.45, 0.095, 0.005])),
+        'annual_inc': np.where(rs.rand(n) < 0.0005, np.nan, np.round(rs.lognormal(np.log(65000), 0.5, n), -2)),
+        'verification_status': np.take(['Not Verified', 'Verified', 'Source Verified'], rs.randint(0, 3, n)),
+        'issue_d': _format_months(issue),
+        'loan_status': loan_status,
+        'purpose': np.take(purposes, rs.choice(len(purposes), n, p=purpose_shares)),
+        'addr_state': np.take(states, rs.choice(len(states), n, p=_zipf_shares(len(states)))),
+        'dti': np.round(rs.beta(2, 4, n) * 40, 2),
+        'delinq_2yrs': rs.poisson(0.3, n),
+        'earliest_cr_line': _with_missing(rs, _format_months(issue - rs.randint(36, 430, n)), 0.0005),
+        'inq_last_6mths': rs.poisson(0.8, n),
+        'mths_since_last_delinq': np.where(rs.rand(n) < 0.55, np.nan, rs.randint(0, 120, n)),
+        'mths_since_last_record': np.where(rs.rand(n) < 0.9, np.nan, rs.randint(0, 120, n)),
+        'open_acc': open_acc,
+        'pub_rec': rs.poisson(0.1, n),
+        'revol_bal': np.round(rs.lognormal(np.log(12000), 0.9, n)),
+        'revol_util': revol_util,
+        'total_acc': open_acc + rs.poisson(12, n),
+        'total_pymnt': total_pymnt,
+        'total_rec_prncp': total_rec_prncp,
+        'recoveries': recoveries,
+        'last_pymnt_d': last_pymnt_d,
+        'mths_since_last_major_derog': np.where(rs.rand(n) < 0.8, np.nan, rs.randint(0, 120, n)),
+        'application_type': np.where(rs.rand(n) < 0.002, 'JOINT', 'INDIVIDUAL'),
+    }, columns=['id', 'member_id', 'loan_amnt', 'funded_amnt', 'term', 'int_rate', 'installment', 'grade', 'sub_grade',
+                'emp_length', 'home_ownership', 'annual_inc', 'verification_status', 'issue_d', 'loan_status',
+                'purpose', 'addr_state', 'dti', 'delinq_2yrs', 'earliest_cr_line', 'inq_last_6mths',
+                'mths_since_last_delinq', 'mths_since_last_record', 'open_acc', 'pub_rec', 'revol_bal', 'revol_util',
+                'total_acc', 'total_pymnt', 'total_rec_prncp', 'recoveries', 'last_pymnt_d',
+                'mths_since_last_major_derog', 'application_type'])
+
+
+def write_loan_stats(n, folder=None, seed=0, **kwargs):
+    '''
+    Writes make_loan_stats(n) as the LoanStats CSVs get_cache_historic reads, split by issue
+    date like LendingClub's files.
+    :param folder: str, defaults to the data folder of get_db_folder
+    returns: list, paths written
+    '''
+    db = get_db_folder()
+    folder = folder or os.path.dirname(db[historic_sources[0]])
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    df = make_loan_stats(n, seed=seed, **kwargs)
+    # loans are generated in issue order, so each file is a slice
+    issue = month_ordinals(parse_months(df['issue_d']))
+    paths = []
+    start = 0
+    for source in historic_sources:
+        last = source_last_months[source]
+        stop = len(df) if last is None else np.searchsorted(issue, pd.Period(last, freq='M').ordinal, side='right')
+        path = os.path.join(folder, os.path.basename(db[source]))
+        df.iloc[start:stop].to_csv(path, index=False)
+        paths.append(path)
+        start = stop
+    return paths